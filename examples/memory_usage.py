@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measures the memory needed for the lines and the parsed data of a large generated configuration
+
+Reports the increase of the resident set size (RSS, including allocator overhead) and the memory allocated by
+Python objects (tracemalloc). Each measurement runs in a separate process as freed memory is not necessarily
+returned to the operating system and tracing itself needs memory.
+"""
+
+import base64
+import io
+import os
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+import wgconfig
+
+
+MODES = {'default': dict(), 'compact': dict(compact=True)}
+
+
+def make_config(count):
+    """Returns the text of a configuration with the given number of peers"""
+    lines = ['[Interface]', 'PrivateKey = {0}'.format(base64.b64encode(os.urandom(32)).decode()), 'ListenPort = 51820']
+    for i in range(count):
+        lines.extend(['', '# peer {0}'.format(i), '[Peer]',
+                      'PublicKey = {0}'.format(base64.b64encode(os.urandom(32)).decode()),
+                      'AllowedIPs = 10.{0}.{1}.0/24, fd00::{2:x}/128'.format(i // 256, i % 256, i),
+                      'Endpoint = 192.0.2.{0}:51820'.format(i % 250),
+                      'PersistentKeepalive = 25'])
+    return '\n'.join(lines) + '\n'
+
+def get_rss():
+    """Returns the current resident set size in bytes (the peak value if /proc is not available)"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kB on Linux
+
+def measure(text, use_tracemalloc, **kwargs):
+    """Returns the memory in MB needed for the lines and the parsed data (RSS or traced memory)"""
+    get_memory = (lambda: tracemalloc.get_traced_memory()[0]) if use_tracemalloc else get_rss
+    wc = wgconfig.WGConfig(**kwargs)
+    if use_tracemalloc:
+        tracemalloc.start()
+    start = get_memory()
+    wc.read_from_fileobj(io.StringIO(text))
+    lines = get_memory()
+    wc.get_peers()
+    parsed = get_memory()
+    return (lines - start) / 1e6, (parsed - lines) / 1e6
+
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+if len(sys.argv) > 2: # measure a single mode in this process
+    name, method = sys.argv[2:4]
+    print('{0} ({1}): lines {2:.1f} MB, parsed data {3:.1f} MB'.format(name, method, *measure(make_config(count), method == 'traced', **MODES[name])))
+else:
+    for name in MODES:
+        for method in ['RSS', 'traced']:
+            sys.stdout.write(subprocess.check_output([sys.executable, __file__, str(count), name, method], universal_newlines=True))
@@ -28,9 +28,12 @@ setup_kwargs = {
         'Intended Audience :: Developers',
         'Intended Audience :: Information Technology'
     ],
+    'entry_points': {
+        'console_scripts': ['wgconfig = wgconfig:main'],
+    },
     'python_requires': '>=2.7',
     'extras_require': {
-        ':python_version == "2.7"': ['future']
+        ':python_version == "2.7"': ['future', 'ipaddress']
     },
     'keywords': 'WireGuard configuration config wg',
     'project_urls': {
@@ -16,7 +16,73 @@ __license__ = "AGPL" # + author has right to release in parallel under different
 __email__ = "towalink.wgconfig@henrici.name"
 
 
+import contextlib
+import datetime
+import functools
+import hashlib
+import io
+import ipaddress
+import itertools
+import json
+import marshal
 import os
+import re
+import sys
+import threading
+try:
+    import fcntl
+except ImportError: # not available on all platforms
+    fcntl = None
+try:
+    from sys import intern
+except ImportError: # Python2 has it as builtin
+    pass
+
+from .rwlock import ReadWriteLock
+from .storage import BlockStorage, LineStorage, SQLiteStorage
+from . import validation
+from .views import SectionView
+from .writebehind import WriteBehind
+
+
+class ConcurrentModificationError(Exception):
+    """The WireGuard config file was changed by someone else since it has been read"""
+    pass
+
+
+def _reader(method):
+    """Decorator for methods that only read the configuration; holds the read lock in thread-safe mode"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._lock is None:
+            return method(self, *args, **kwargs)
+        with self._lock.read_locked():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _writer(method):
+    """Decorator for methods that modify the configuration; holds the write lock in thread-safe mode and unshares data shared with snapshots"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.readonly:
+            raise TypeError('The configuration is a read-only snapshot')
+        if self._lock is None:
+            self.unshare_data()
+            return method(self, *args, **kwargs)
+        with self._lock.write_locked():
+            self.unshare_data()
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _mutator(method):
+    """Decorator for the methods that change the configuration; like "_writer" and additionally notes the change for writing behind"""
+    method = _writer(method)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.note_change()
+        return result
+    return wrapper
 
 
 class WGConfig():
@@ -25,15 +91,45 @@ class WGConfig():
     SECTION_FIRSTLINE = '_index_firstline'
     SECTION_LASTLINE = '_index_lastline'
     SECTION_RAW = '_rawdata'
+    SECTION_HASH = '_hash'
+    SECTION_COMMENT = '_leading_comment'
+    DATE_PATTERN = re.compile(r'\b(\d{4})-(\d{2})-(\d{2})\b') # dates (ISO format) in comments of disabled peers
+    WG_QUICK_ATTRS = ['address', 'dns', 'mtu', 'table', 'preup', 'postup', 'predown', 'postdown', 'saveconfig'] # not understood by "wg setconf" (lower case)
+    INTERN_MAXLEN = 16 # values up to this length are interned when parsing
     _interface = None # interface attributes
     _peers = None # peer data
-
-    def __init__(self, file=None, keyattr='PublicKey'):
+    _lock = None # reader/writer lock in thread-safe mode
+    _data_shared = False # whether lines and parsed data are shared with a snapshot
+    _locked_file = None # tuple of file currently locked by lock_file() and the locking thread
+    file_signature = None # size, modification time and hash of the file when it was last read or written
+    readonly = False # whether this is a read-only snapshot
+    _write_behind = None # background writer in write-behind mode
+
+    def __init__(self, file=None, keyattr='PublicKey', threadsafe=False, storage=None, validate_on_mutate=False, compact=False, write_behind=None, write_behind_changes=100):
         """Object initialization"""
         self.filename = self.file2filename(file)
         self.keyattr = keyattr
-        self.lines = []
-        self.initialize_file()
+        self.compact = compact # omit "_rawdata" in parsed data to save memory
+        self.validate_on_mutate = validate_on_mutate
+        self._validation_cache = dict() # section hash -> tuple of problems and networks in "AllowedIPs"
+        self._views = dict() # section hash -> SectionView
+        if threadsafe or (write_behind is not None): # the background writer reads concurrently
+            self._lock = ReadWriteLock()
+        self._parse_lock = threading.Lock()
+        self.storage = LineStorage() if storage is None else storage
+        if next(iter(self.storage.iter_lines(self)), None) is None: # keep lines of a storage that is already filled (e.g. a database)
+            self.initialize_file()
+        if write_behind is not None:
+            if self.filename is None:
+                raise ValueError('A filename needs to be provided for writing behind')
+            write = functools.partial(self.write_file, self.filename, check_unchanged=True) # never overwrite changes of others
+            self._write_behind = WriteBehind(write, write_behind, write_behind_changes, self._lock.read_locked)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     @staticmethod
     def file2filename(file):
@@ -51,32 +147,258 @@ class WGConfig():
         self._interface = None
         self._peers = None
 
+    @property
+    def lines(self):
+        """List of lines of the WireGuard config file"""
+        return self.storage.get_lines(self)
+
+    @lines.setter
+    def lines(self, lines):
+        self.storage.set_lines(self, lines)
+
+    def unshare_data(self):
+        """Copies lines and parsed data before modifying them in case they are shared with a snapshot"""
+        if self._data_shared:
+            self.storage.unshare()
+            if self._peers is not None:
+                self._peers = dict(self._peers)
+            self._data_shared = False
+
+    def share_data(self):
+        """Returns a new object sharing lines and parsed data with this one (the caller holds the lock)"""
+        self.parse_lines_if_needed()
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other.storage = self.storage.share()
+        other._validation_cache = dict(self._validation_cache)
+        other._views = dict(self._views)
+        other._parse_lock = threading.Lock()
+        other._locked_file = None
+        other._write_behind = None
+        self._data_shared = True
+        return other
+
+    @_reader
+    def snapshot(self):
+        """Returns an immutable snapshot of the configuration that shares the data until this object gets modified"""
+        snapshot = self.share_data()
+        snapshot._lock = None # immutable, thus no locking needed
+        snapshot.readonly = True
+        return snapshot
+
+    @_reader
+    def copy(self):
+        """Returns a modifiable copy of the configuration; both objects share the data and copy only what they modify (copy-on-write, per section with BlockStorage)"""
+        clone = self.share_data()
+        clone._lock = None if self._lock is None else ReadWriteLock()
+        clone.readonly = False
+        clone._data_shared = True
+        return clone
+
+    def __copy__(self):
+        return self.copy()
+
+    @_mutator
     def read_from_fileobj(self, fobj):
         """Reads from the given file object into memory"""
         self.lines = [line.rstrip() for line in fobj.readlines()]
         self.invalidate_data()
 
+    @_reader
     def write_to_fileobj(self, fobj):
         """Writes from memory to the given file object"""
-        fobj.writelines(line + '\n' for line in self.lines)
+        fobj.writelines(line + '\n' for line in self.storage.iter_lines(self))
+
+    @_reader
+    def get_wg_setconf_lines(self):
+        """Returns the lines of the configuration as understood by "wg setconf"/"wg syncconf" (like "wg-quick strip")"""
+        def iter_section(header, section_data):
+            yield header
+            for attr, value in section_data.items():
+                if attr.startswith('_') or (attr.lower() in self.WG_QUICK_ATTRS):
+                    continue
+                yield '{0} = {1}'.format(attr, self.format_value(value))
+
+        peers = self.peers
+        lines = []
+        if (len(self.interface) > 0) and not self.interface[self.SECTION_DISABLED]:
+            lines.extend(iter_section('[Interface]', self.interface))
+        for key in self.storage.get_peer_keys(self):
+            lines.append('')
+            lines.extend(iter_section('[Peer]', peers[key]))
+        return lines
+
+    def iter_wg_setconf_lines(self):
+        """Returns an iterator over the lines of "get_wg_setconf_lines"; they are built at once, so that no lock is held while iterating"""
+        return iter(self.get_wg_setconf_lines())
+
+    def to_wg_setconf(self, fobj=None):
+        """Returns the configuration as understood by "wg setconf"/"wg syncconf" or writes it to the given file object; wg-quick attributes, disabled sections and comments are left out"""
+        lines = [line + '\n' for line in self.get_wg_setconf_lines()]
+        if fobj is None:
+            return ''.join(lines)
+        fobj.writelines(lines)
 
+    @staticmethod
+    def get_file_signature(filename, data=None):
+        """Returns size, modification time and hash of the given file ("None" if it does not exist)"""
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        if data is None:
+            with open(filename, 'rb') as wgfile:
+                data = wgfile.read()
+        return (stat.st_size, stat.st_mtime, hashlib.sha256(data).hexdigest())
+
+    def file_changed(self, filename):
+        """Checks whether the given file changed since it was last read or written"""
+        if self.file_signature is None:
+            return os.path.exists(filename) and (os.path.getsize(filename) > 0) # an empty file may have been created by lock_file()
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return True
+        if (stat.st_size, stat.st_mtime) == self.file_signature[:2]:
+            return False # cheap check first
+        signature = self.get_file_signature(filename)
+        return (signature is None) or (signature[2] != self.file_signature[2])
+
+    @contextlib.contextmanager
+    def lock_file(self, file=None, shared=False):
+        """Holds an advisory lock (fcntl/flock) on the WireGuard config file; other processes using wgconfig wait for it"""
+        filename = self.filename if file is None else self.file2filename(file)
+        if filename is None:
+            raise ValueError('A filename needs to be provided')
+        if (fcntl is None) or (self._locked_file == (filename, threading.current_thread())): # not supported or already locked
+            yield
+            return
+        flags = os.O_RDONLY if shared else os.O_RDONLY | os.O_CREAT
+        fd = os.open(filename, flags, 0o640)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self._locked_file = (filename, threading.current_thread())
+            try:
+                yield
+            finally:
+                self._locked_file = None
+        finally:
+            os.close(fd) # this releases the lock, too
+
+    @_writer
     def read_file(self):
         """Reads the WireGuard config file into memory"""
         if self.filename is None:
             raise ValueError('A filename needs to be provided on object creation')
-        with open(self.filename, 'r') as wgfile:
-            self.read_from_fileobj(wgfile)
-
-    def write_file(self, file=None):
-        """Writes a WireGuard config file from memory to file"""
+        with self.lock_file(shared=True):
+            with open(self.filename, 'rb') as wgfile:
+                data = wgfile.read()
+            self.file_signature = self.get_file_signature(self.filename, data)
+        self.read_from_fileobj(io.StringIO(data.decode('utf-8')))
+        if self._write_behind is not None:
+            self._write_behind.discard_changes() # the memory matches the file
+
+    @_reader
+    def write_file(self, file=None, check_unchanged=False):
+        """Writes a WireGuard config file from memory to file; optionally fails if the file changed since it was read"""
+        if (self._write_behind is not None) and (file is None) and not check_unchanged:
+            return # changes are counted by the modifying methods and written by the background writer
         if file is None:
             filename = self.filename
         else:
             filename = self.file2filename(file)
         if filename is None:
             raise ValueError('A filename needs to be provided')
-        with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640), 'w') as wgfile:
-            self.write_to_fileobj(wgfile)
+        with self.lock_file(filename):
+            if check_unchanged and self.file_changed(filename):
+                raise ConcurrentModificationError('The file [{0}] changed since it was read'.format(filename))
+            with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640), 'w') as wgfile:
+                self.write_to_fileobj(wgfile)
+            if filename == self.filename:
+                self.file_signature = self.get_file_signature(filename)
+                if self._write_behind is not None:
+                    self._write_behind.discard_changes() # written, no need to write behind (changes can't happen meanwhile due to the read lock)
+
+    def note_change(self):
+        """Notes a change of the content for writing behind"""
+        if self._write_behind is not None:
+            self._write_behind.note_change()
+
+    def flush(self):
+        """Writes unwritten changes immediately in write-behind mode"""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+
+    def close(self):
+        """Stops writing behind after writing unwritten changes"""
+        if self._write_behind is not None:
+            self._write_behind.stop()
+            self._write_behind = None
+
+    @_writer
+    def modify(self, func, retries=3):
+        """Reads the file, calls "func" with this object to apply changes and writes the file unless someone else changed it meanwhile (then retrying); the last attempt holds the file lock throughout"""
+        self.flush()
+        for attempt in range(retries):
+            self.read_file()
+            func(self)
+            try:
+                self.write_file(check_unchanged=True)
+                return
+            except ConcurrentModificationError:
+                pass
+        with self.lock_file():
+            self.read_file()
+            func(self)
+            self.write_file(self.filename) # written now (also in write-behind mode) while the file is locked
+
+    @_reader
+    def export_jsonl(self, fobj):
+        """Writes one JSON record per section (in file order) to the given file object"""
+        for section, section_data in self.storage.iter_sections(self):
+            rawdata = section_data[self.SECTION_RAW]
+            disabled = section_data[self.SECTION_DISABLED]
+            leading_comment = []
+            for line in rawdata:
+                if disabled:
+                    line = line.replace('#! ', '', 1)
+                if line.strip().startswith('['):
+                    break
+                leading_comment.append(line)
+            record = {
+                'section': section,
+                'disabled': disabled,
+                'leading_comment': leading_comment,
+                'data': self.get_filtered_dictionary(section_data),
+            }
+            fobj.write(json.dumps(record) + '\n')
+
+    @_mutator
+    def import_jsonl(self, fobj):
+        """Replaces the data in memory by the sections read from the given file object with JSON records (see export_jsonl)"""
+        lines = []
+        for record in fobj:
+            if len(record.strip()) == 0:
+                continue
+            record = json.loads(record)
+            if len(lines) > 0:
+                lines.append('') # append an empty line for separation
+            section_lines = list(record.get('leading_comment', []))
+            section_lines.append('[{0}]'.format(record['section'].capitalize()))
+            for attr, value in record['data'].items():
+                section_lines.append('{0} = {1}'.format(attr, self.format_value(value)))
+            if record.get('disabled', False):
+                section_lines = ['#! ' + line for line in section_lines]
+            lines.extend(section_lines)
+        self.lines = lines
+        self.invalidate_data()
+
+    @staticmethod
+    def format_value(value):
+        """Joins a parsed attribute value (single value or list of values) for use in an attr/value line"""
+        if isinstance(value, list):
+            return ', '.join(str(item) for item in value)
+        return str(value)
 
     @staticmethod
     def parse_line(line):
@@ -93,35 +415,34 @@ class WGConfig():
             value = [item.strip() for item in value.split(',')] # decompose into list based on commata as separator
         return attr, value, comment
 
-    def parse_lines(self):
-        """Parses the lines of a WireGuard config file into memory"""
+    def iter_sections(self, lines=None, include_raw=True):
+        """Parses the given lines (default: the lines in memory) and yields a tuple of section name and section data per section"""
 
         # There will be two special attributes in the parsed data:
         #_index_firstline: Line (zero indexed) of the section header (including any leading lines with comments)
         #_index_lastline: Line (zero indexed) of the last attribute line of the section (including any directly following comments)
+        # Furthermore, "_hash" is a hash of the attributes/values and the disabled state of the section (comments don't matter)
+        # and "_leading_comment" contains the comment lines directly before the section header (only if there are any)
+        # Attribute names and short values are interned as they occur in many sections
 
-        def close_section(section, section_data):
+        def close_section(section_data):
             section_data = {k: (v if len(v) > 1 else v[0]) for k, v in section_data.items()}
-            if section is None: # nothing to close on first section
-                return
-            elif section == 'interface': # close interface section
-                self._interface = section_data
-            else: # close peer section
-                peername = section_data.get(self.keyattr)
-                self._peers[peername] = section_data
-            section_data[self.SECTION_RAW] = self.lines[section_data[self.SECTION_FIRSTLINE]:(section_data[self.SECTION_LASTLINE] + 1)]
+            if include_raw:
+                section_data[self.SECTION_RAW] = lines[section_data[self.SECTION_FIRSTLINE]:(section_data[self.SECTION_LASTLINE] + 1)]
             # Checking if the section is disabled and adding an attribute to section data
-            if section_data[self.SECTION_RAW][0].startswith('#! '):
+            if lines[section_data[self.SECTION_FIRSTLINE]].startswith('#! '):
                 section_data[self.SECTION_DISABLED] = True
             else:
                 section_data[self.SECTION_DISABLED] = False
+            section_data[self.SECTION_HASH] = self.get_section_hash(section_data)
+            return section_data
 
-        self._interface = dict()
-        self._peers = dict()
+        if lines is None:
+            lines = self.lines
         section = None
         section_data = dict()
         last_empty_line_in_section = -1 # virtual empty line before start of file
-        for i, line in enumerate(self.lines):
+        for i, line in enumerate(lines):
             # Ignore leading whitespace and trailing whitespace
             line = line.replace('#! ', '').strip()
             # Ignore empty lines and comments
@@ -131,13 +452,16 @@ class WGConfig():
             if line.startswith('['): # section
                 if last_empty_line_in_section is not None:
                     section_data[self.SECTION_LASTLINE] = [last_empty_line_in_section - 1]
-                close_section(section, section_data)
+                if section is not None: # nothing to close on first section
+                    yield section, close_section(section_data)
                 section_data = dict()
                 section = line[1:].partition(']')[0].lower()
                 if last_empty_line_in_section is None:
                     section_data[self.SECTION_FIRSTLINE] = [i]
                 else:
                     section_data[self.SECTION_FIRSTLINE] = [last_empty_line_in_section + 1]
+                    if last_empty_line_in_section + 1 < i:
+                        section_data[self.SECTION_COMMENT] = ['\n'.join(item.replace('#! ', '', 1).strip() for item in lines[(last_empty_line_in_section + 1):i])]
                     last_empty_line_in_section = None
                 section_data[self.SECTION_LASTLINE] = [i]
                 if not section in ['interface', 'peer']:
@@ -146,23 +470,79 @@ class WGConfig():
                 section_data[self.SECTION_LASTLINE] = [i]
             else: # regular line
                 attr, value, _comment = self.parse_line(line)
+                attr = intern(attr)
+                value = [intern(item) if (not isinstance(item, int)) and (len(item) <= self.INTERN_MAXLEN) else item for item in value]
                 section_data[attr] = section_data.get(attr, [])
                 section_data[attr].extend(value)
                 section_data[self.SECTION_LASTLINE] = [i]
-        close_section(section, section_data)
+        if section is not None:
+            yield section, close_section(section_data)
+
+    @staticmethod
+    def set_attr_in_lines(lines, attr, value):
+        """Returns a copy of the given section lines with the attribute set to the given value in place of its first line, keeping comments and the disabled state ("None" removes the attribute)"""
+        result = []
+        found = False
+        for line in lines:
+            prefix = '#! ' if line.startswith('#! ') else ''
+            content = line[len(prefix):].strip()
+            if (len(content) == 0) or (content[0] in '#['):
+                result.append(line)
+                continue
+            line_attr, _line_value, line_comment = WGConfig.parse_line(content)
+            if line_attr != attr:
+                result.append(line)
+            elif (not found) and (value is not None):
+                if len(line_comment) > 0:
+                    line_comment = ' ' + line_comment
+                result.append(prefix + attr + ' = ' + WGConfig.format_value(value) + line_comment)
+                found = True
+        if (not found) and (value is not None):
+            prefix = '#! ' if (len(lines) > 0) and lines[0].startswith('#! ') else ''
+            result.append(prefix + attr + ' = ' + WGConfig.format_value(value))
+        return result
 
-    def handle_leading_comment(self, leading_comment):
-        """Appends a leading comment for a section"""
+    @staticmethod
+    def get_section_hash(section_data):
+        """Returns a hash of the attributes/values and the disabled state of the given section data"""
+        content = sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in section_data.items() if not k.startswith('_'))
+        content.append(section_data.get(WGConfig.SECTION_DISABLED, False))
+        # Marshal format 2 is cheaper than repr() and, unlike hash(), the same in all processes (no references, no hash randomization)
+        return hashlib.sha256(marshal.dumps(content, 2)).hexdigest()[:16]
+
+    def parse_lines(self):
+        """Parses the lines of a WireGuard config file into memory"""
+        interface, peers = self.storage.parse(self)
+        # Publish the data only when complete as concurrent readers might access it
+        self._peers = peers
+        self._interface = interface
+
+    def parse_lines_if_needed(self):
+        """Parses the lines unless the parsed data is still valid; only one thread parses at a time"""
+        if (self._interface is None) or (self._peers is None):
+            with self._parse_lock:
+                if (self._interface is None) or (self._peers is None):
+                    self.parse_lines()
+
+    @_writer
+    def handle_leading_comment(self, leading_comment, lines=None):
+        """Appends a leading comment for a section (to the given list of lines of a new section or to the lines in memory)"""
         if leading_comment is not None:
             if leading_comment.strip()[0] != '#':
                 raise ValueError('A comment needs to start with a "#"')
-            self.lines.append(leading_comment)
+            if lines is None:
+                self.storage.add_section(self, [leading_comment]) # the storage may not hand out its lines for modification
+                self.note_change()
+            else:
+                lines.append(leading_comment)
 
+    @_mutator
     def initialize_file(self, leading_comment=None):
         """Empties the file and adds the interface section header"""
-        self.lines = list()
-        self.handle_leading_comment(leading_comment) # add leading comment if needed
-        self.lines.append('[Interface]')
+        lines = list()
+        self.handle_leading_comment(leading_comment, lines) # add leading comment if needed
+        lines.append('[Interface]')
+        self.lines = lines
         self.invalidate_data()
 
     def get_filtered_dictionary(self, data, include_details=False):
@@ -175,20 +555,30 @@ class WGConfig():
             data = { key: value for key, value in data.items() if not key.startswith('_') }
         return data    
 
+    @_reader
     def get_interface(self, include_details=False):
         """Returns the data of the interface section"""
         return self.get_filtered_dictionary(self.interface, include_details)
 
-    def get_peers(self, keys_only=True, include_disabled=False, include_details=False):
-        """Returns peer data or a list of peers (i.e. their public keys)"""
-        # Get (possibly) filtered peers dictionary
-        peerdata = { key: value for key, value in self.peers.items() if include_disabled or not value.get('_disabled', False) }
+    @_reader
+    def get_peers(self, keys_only=True, include_disabled=False, include_details=False, fields=None, offset=0, limit=None, predicate=None):
+        """Returns peer data or a list of peers (i.e. their public keys) in file order, optionally paginated and projected"""
+        peers = self.peers
+        # Get the keys of the (possibly) filtered peers; the key lists are cached so that no peer data is touched here
+        keys = self.storage.get_peer_keys(self, include_disabled)
+        stop = None if limit is None else offset + limit
+        if predicate is None:
+            keys = keys[offset:stop]
+        else:
+            keys = list(itertools.islice((key for key in keys if predicate(peers[key])), offset, stop))
         # Return requested data
         if keys_only:
-            return list(peerdata.keys())
-        else:
-            return { key: self.get_filtered_dictionary(value, include_details) for key, value in peerdata.items() }
+            return keys
+        if fields is not None:
+            return { key: { field: peers[key][field] for field in fields if field in peers[key] } for key in keys }
+        return { key: self.get_filtered_dictionary(peers[key], include_details) for key in keys }
 
+    @_reader
     def get_peer(self, key, include_details=False):
         """Returns the data of the peer with the given (public) key"""
         try:
@@ -197,37 +587,74 @@ class WGConfig():
             raise KeyError('The peer does not exist')
         return self.get_filtered_dictionary(peerdata, include_details)
 
+    def get_view(self, section_data):
+        """Returns the (cached) typed view of the given section data; views are reused for sections with equal hash"""
+        section_hash = section_data[self.SECTION_HASH]
+        view = self._views.get(section_hash)
+        if view is None:
+            if len(self._views) > 2 * (len(self.peers) + 1): # drop views of outdated sections
+                self._views = dict()
+            view = SectionView(section_data)
+            self._views[section_hash] = view
+        return view
+
+    @_reader
+    def find_peers_by_comment(self, text):
+        """Returns the keys of the peers whose leading comment contains all words of the given text (case-insensitive, whole words)"""
+        self.parse_lines_if_needed()
+        return sorted(self.storage.get_comment_index(self).find(text))
+
+    @_reader
+    def get_rawdata(self, key):
+        """Returns the lines of the section identified by the given key ("None" for interface section), also if omitted in the parsed data"""
+        section_data = self.interface if key is None else self.peers[key]
+        if self.SECTION_RAW in section_data:
+            return section_data[self.SECTION_RAW]
+        lines = self.storage.get_section_lines(self, key, modify=False)
+        return lines[section_data[self.SECTION_FIRSTLINE]:(section_data[self.SECTION_LASTLINE] + 1)]
+
+    @_reader
+    def interface_view(self):
+        """Returns a typed view of the interface section with values decoded on first access"""
+        return self.get_view(self.interface)
+
+    @_reader
+    def peer_view(self, key):
+        """Returns a typed view of the peer with the given (public) key with values decoded on first access"""
+        try:
+            peerdata = self.peers[key]
+        except KeyError:
+            raise KeyError('The peer does not exist')
+        return self.get_view(peerdata)
+
+    @_mutator
     def add_peer(self, key, leading_comment=None):
         """Adds a new peer with the given (public) key"""
         if key in self.peers:
             raise KeyError('Peer to be added already exists')
-        self.lines.append('') # append an empty line for separation
-        self.handle_leading_comment(leading_comment) # add leading comment if needed
+        self.check_value(self.keyattr, key)
+        lines = [''] # append an empty line for separation
+        self.handle_leading_comment(leading_comment, lines) # add leading comment if needed
         # Append peer with key attribute
-        self.lines.append('[Peer]')
-        self.lines.append('{0} = {1}'.format(self.keyattr, key))
-        # Invalidate data cache
-        self.invalidate_data()
-
+        lines.append('[Peer]')
+        lines.append('{0} = {1}'.format(self.keyattr, key))
+        self.storage.add_section(self, lines)
+
+    @_mutator
+    def add_section_lines(self, section_lines):
+        """Appends a section given as list of lines (e.g. obtained by "get_rawdata" of another configuration) including its comments"""
+        lines = [''] # append an empty line for separation
+        lines.extend(section_lines)
+        self.storage.add_section(self, lines)
+
+    @_mutator
     def del_peer(self, key):
         """Removes the peer with the given (public) key"""
         if not key in self.peers:
             raise KeyError('The peer to be deleted does not exist')
-        section_firstline = self.peers[key][self.SECTION_FIRSTLINE]
-        section_lastline = self.peers[key][self.SECTION_LASTLINE]
-        # Remove a blank line directly before the peer section
-        if section_firstline > 0:
-            if len(self.lines[section_firstline - 1]) == 0:
-                section_firstline -= 1
-        # Only keep needed lines
-        result = []
-        if section_firstline > 0:
-            result.extend(self.lines[0:section_firstline])
-        result.extend(self.lines[(section_lastline + 1):])
-        self.lines = result
-        # Invalidate data cache
-        self.invalidate_data()
+        self.storage.remove_section(self, key)
 
+    @_reader
     def get_sectioninfo(self, key):
         """Get first and last line of the section identified by the given key ("None" for interface section)"""
         if key is None: # interface
@@ -240,43 +667,159 @@ class WGConfig():
             section_lastline = self.peers[key][self.SECTION_LASTLINE]
         return section_firstline, section_lastline
 
+    @_writer
+    def get_section_lines(self, key):
+        """Get the (modifiable) list of lines containing the section identified by the given key ("None" for interface section) and first and last line of the section in it"""
+        section_firstline, section_lastline = self.get_sectioninfo(key)
+        return self.storage.get_section_lines(self, key), section_firstline, section_lastline
+
+    @_mutator
     def add_attr(self, key, attr, value, leading_comment=None, append_as_line=False):
         """Adds an attribute/value pair to the given peer ("None" for adding an interface attribute)"""
-        section_firstline, section_lastline = self.get_sectioninfo(key)
         if leading_comment is not None:
             if leading_comment.strip()[0] != '#':
                 raise ValueError('A comment needs to start with a "#"')
+        self.check_value(attr, value)
+        lines, section_firstline, section_lastline = self.get_section_lines(key)
         # Look for line with the attribute
         line_found = None
         for i in range(section_firstline + 1, section_lastline + 1):
-            line_attr, line_value, line_comment = self.parse_line(self.lines[i])
+            line_attr, line_value, line_comment = self.parse_line(lines[i])
             if attr == line_attr:
                 line_found = i
         # Add the attribute at the right place
         if (line_found is None) or append_as_line:
             line_found = section_lastline if (line_found is None) else line_found
             line_found += 1
-            self.lines.insert(line_found, '{0} = {1}'.format(attr, value))
+            lines.insert(line_found, '{0} = {1}'.format(attr, value))
         else:
-            line_attr, line_value, line_comment = self.parse_line(self.lines[line_found])
+            line_attr, line_value, line_comment = self.parse_line(lines[line_found])
             line_value.append(value)
             if len(line_comment) > 0:
                 line_comment = ' ' + line_comment
             line_value = [str(item) for item in line_value]
-            self.lines[line_found] = line_attr + ' = ' + ', '.join(line_value) + line_comment
+            lines[line_found] = line_attr + ' = ' + ', '.join(line_value) + line_comment
         # Handle leading comments
         if leading_comment is not None:
-            self.lines.insert(line_found, leading_comment)
-        # Invalidate data cache
+            lines.insert(line_found, leading_comment)
+        # Update data cache
+        self.storage.section_changed(self, key)
+
+    @_writer
+    def set_attr(self, key, attr, value):
+        """Sets an attribute of the given peer ("None" for the interface) to the given value (or list of values), replacing the existing line in place and keeping its comment ("None" removes the attribute)"""
+        self.update_peers({key: {attr: value}})
+
+    @_mutator
+    def update_peers(self, changes):
+        """Sets attributes of many peers in a single pass; "changes" is a dictionary of peer key and dictionary of attribute and value (see "set_attr")"""
+        for key, attrs in changes.items():
+            self.get_sectioninfo(key) # raises KeyError if the section does not exist
+            for attr, value in attrs.items():
+                if value is not None:
+                    self.check_value(attr, self.format_value(value))
+        def get_update(attrs):
+            def update(lines):
+                for attr, value in attrs.items():
+                    lines = self.set_attr_in_lines(lines, attr, value)
+                return lines
+            return update
+        self.storage.update_sections(self, { key: get_update(attrs) for key, attrs in changes.items() })
+
+    def compact_allowed_ips(self, key=None, dry_run=False):
+        """Collapses adjacent and overlapping networks in "AllowedIPs" of the given peer ("None" for all peers) into as few as possible on a single line; returns a dictionary of key and tuple of network count before and after for the affected peers ("None" for peers with an invalid value, which are left alone); a dry run only reads the configuration"""
+        if dry_run:
+            return self.get_compacted_allowed_ips(key)[0]
+        return self.apply_compacted_allowed_ips(key)
+
+    @_reader
+    def get_compacted_allowed_ips(self, key=None):
+        """Returns a tuple of the report of "compact_allowed_ips" and the changes (see "update_peers") collapsing the networks in "AllowedIPs" of the given peer ("None" for all peers)"""
+        keys = self.get_peers(include_disabled=True) if key is None else [key]
+        report = dict()
+        changes = dict()
+        for peer_key in keys:
+            try:
+                networks = self.peer_view(peer_key).allowed_ips
+            except ValueError: # invalid value (see "validate"); not to be touched
+                report[peer_key] = None
+                continue
+            collapsed = []
+            for version in (4, 6):
+                collapsed.extend(ipaddress.collapse_addresses(network for network in networks if network.version == version))
+            if len(collapsed) < len(networks):
+                report[peer_key] = (len(networks), len(collapsed))
+                changes[peer_key] = {'AllowedIPs': [str(network) for network in collapsed]}
+        return report, changes
+
+    @_writer
+    def apply_compacted_allowed_ips(self, key=None):
+        """Collapses the networks in "AllowedIPs" of the given peer ("None" for all peers) holding the write lock from computing to applying the changes; returns the report (see "compact_allowed_ips")"""
+        report, changes = self.get_compacted_allowed_ips(key)
+        if len(changes) > 0:
+            self.update_peers(changes)
+        return report
+
+    def get_comment_date(self, section_data):
+        """Returns the latest date (ISO format, e.g. "2024-01-31") in the leading comment of the given section ("None" if there is none)"""
+        dates = []
+        for match in self.DATE_PATTERN.finditer(section_data.get(self.SECTION_COMMENT, '')):
+            try:
+                dates.append(datetime.date(*[int(item) for item in match.groups()]))
+            except ValueError: # not a valid date
+                pass
+        return max(dates) if len(dates) > 0 else None
+
+    @_mutator
+    def compact_file(self, archive_file=None, disabled_before=None, write=True):
+        """Removes disabled peers (optionally only those with a date in their leading comment before "disabled_before") appending them to the archive file (if given), collapses runs of empty lines and writes the file; returns the keys of the removed peers"""
+        if isinstance(disabled_before, datetime.datetime):
+            disabled_before = disabled_before.date()
+        lines = self.lines
+        removed_keys = []
+        removed_lines = []
+        keep = [True] * len(lines)
+        for section, section_data in self.iter_sections(lines, include_raw=False):
+            if (section != 'peer') or not section_data[self.SECTION_DISABLED]:
+                continue
+            if disabled_before is not None:
+                date = self.get_comment_date(section_data)
+                if (date is None) or (date >= disabled_before):
+                    continue
+            firstline, lastline = section_data[self.SECTION_FIRSTLINE], section_data[self.SECTION_LASTLINE]
+            removed_keys.append(section_data.get(self.keyattr))
+            removed_lines.append(lines[firstline:lastline + 1])
+            keep[firstline:lastline + 1] = [False] * (lastline + 1 - firstline)
+        # Single pass over the lines keeping at most one empty line between non-empty lines
+        result = []
+        for i, line in enumerate(lines):
+            if not keep[i]:
+                continue
+            if len(line.strip()) == 0:
+                if (len(result) == 0) or (len(result[-1].strip()) == 0):
+                    continue
+                line = ''
+            result.append(line)
+        if (len(result) > 0) and (len(result[-1]) == 0):
+            result.pop()
+        if (archive_file is not None) and (len(removed_lines) > 0):
+            with open(os.open(archive_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640), 'a') as archive: # archive first so that no peer gets lost; like the configuration it contains keys
+                for section_lines in removed_lines:
+                    archive.writelines(line + '\n' for line in [''] + section_lines)
+        self.lines = result
         self.invalidate_data()
+        if write and (self.filename is not None):
+            self.write_file()
+        return removed_keys
 
+    @_mutator
     def del_attr(self, key, attr, value=None, remove_leading_comments=True):
         """Removes an attribute/value pair from the given peer ("None" for removing an interface attribute); set 'value' to 'None' to remove all values"""
-        section_firstline, section_lastline = self.get_sectioninfo(key)
+        lines, section_firstline, section_lastline = self.get_section_lines(key)
         # Find all lines with matching attribute name and (if requested) value
         line_found = []
         for i in range(section_firstline + 1, section_lastline + 1):
-            line_attr, line_value, line_comment = self.parse_line(self.lines[i])
+            line_attr, line_value, line_comment = self.parse_line(lines[i])
             if attr == line_attr:
                 if (value is None) or (value in line_value):
                     line_found.append(i)
@@ -285,83 +828,129 @@ class WGConfig():
         # Process all relevant lines
         for i in reversed(line_found): # reversed so that non-processed indices stay valid
             if value is None:
-                del(self.lines[i])
+                del(lines[i])
             else:
-                line_attr, line_value, line_comment = self.parse_line(self.lines[i])
+                line_attr, line_value, line_comment = self.parse_line(lines[i])
                 line_value.remove(value)
                 if len(line_value) > 0: # keep remaining values in that line
-                    self.lines[i] = line_attr + ' = ' + ', '.join(line_value) + line_comment
+                    lines[i] = line_attr + ' = ' + ', '.join(line_value) + line_comment
                 else: # otherwise line is no longer needed
-                    del(self.lines[i])
+                    del(lines[i])
         # Handle leading comments
         if remove_leading_comments:
             i = line_found[0] - 1
             while i > 0:
-                if len(self.lines[i]) and (self.lines[i][0] == '#'):
-                    del(self.lines[i])
+                if len(lines[i]) and (lines[i][0] == '#'):
+                    del(lines[i])
                     i -= 1
                 else:
                     break
-        # Invalidate data cache
-        self.invalidate_data()
-
+        # Update data cache
+        self.storage.section_changed(self, key)
+
+    def check_value(self, attr, value):
+        """Raises a ValueError if validation on mutation is enabled and the given value is not valid for the given attribute"""
+        if not self.validate_on_mutate:
+            return
+        attr, values, _comment = self.parse_line('{0} = {1}'.format(attr, value))
+        problems = validation.check_values(attr, values)
+        if len(problems) > 0:
+            value, message = problems[0]
+            raise ValueError('Invalid value "{0}" for attribute "{1}": {2}'.format(value, attr, message))
+
+    @_reader
+    def validate(self):
+        """Checks keys, addresses, ports, endpoints and keepalive intervals as well as duplicate peers and networks; returns a list of problems"""
+        problems = []
+        cache = dict()
+        networks = dict() # network -> key of the peer using it in "AllowedIPs"
+        sections = [(None, self.interface)] if len(self.interface) > 0 else []
+        sections.extend(self.peers.items())
+        for key, section_data in sections:
+            section_hash = section_data[self.SECTION_HASH]
+            # Check the attributes of each section unless already done for an equal section
+            cached = self._validation_cache.get(section_hash)
+            if cached is None:
+                section_problems = validation.check_section(section_data)
+                invalid = set(value for attr, value, message in section_problems if attr == 'AllowedIPs')
+                section_networks = section_data.get('AllowedIPs', [])
+                if not isinstance(section_networks, list):
+                    section_networks = [section_networks]
+                section_networks = [str(ipaddress.ip_network(str(value), strict=False)) for value in section_networks if value not in invalid]
+                cached = (section_problems, section_networks)
+            cache[section_hash] = cached
+            section_problems, section_networks = cached
+            problems.extend({'key': key, 'attr': attr, 'value': value, 'message': message} for attr, value, message in section_problems)
+            # Check for networks used by several enabled peers
+            if section_data[self.SECTION_DISABLED]:
+                continue
+            for network in section_networks:
+                other = networks.setdefault(network, key)
+                if other != key:
+                    problems.append({'key': key, 'attr': 'AllowedIPs', 'value': network, 'message': 'network is also used by peer {0}'.format(other)})
+        for key in self.storage.duplicate_keys:
+            problems.append({'key': key, 'attr': self.keyattr, 'value': key, 'message': 'peer occurs more than once'})
+        self._validation_cache = cache # only keep results for current sections
+        return problems
+
+    @_reader
     def get_peer_enabled(self, key):
         """Checks whether the peer with the given (public) key is enabled"""
         peerdata = self.get_peer(key, include_details=True)
         return not peerdata.get(self.SECTION_DISABLED)
 
+    @_mutator
     def enable_peer(self, key):
         """Enables the peer with the given (public) key by removing #! from all lines in a peer section"""
         if key not in self.peers:
             raise KeyError('The peer to be enabled does not exist')
-        section_firstline = self.peers[key][self.SECTION_FIRSTLINE]
-        section_lastline = self.peers[key][self.SECTION_LASTLINE]
-        result = []
+        lines, section_firstline, section_lastline = self.get_section_lines(key)
         # Remove #! from lines
-        for i, line in enumerate(self.lines):
-            if section_firstline <= i <= section_lastline:
-                line = line.replace('#! ', '')
-            result.append(line)
-        self.lines = result
-        # Invalidate data cache
-        self.invalidate_data()
+        for i in range(section_firstline, section_lastline + 1):
+            lines[i] = lines[i].replace('#! ', '')
+        # Update data cache
+        self.storage.section_changed(self, key)
 
+    @_mutator
     def disable_peer(self, key):
         """Disables the peer with the given (public) key by appending #! to all lines in a peer section"""
         if key not in self.peers:
             raise KeyError('The peer to be disabled does not exist')
         if not self.get_peer_enabled(key):
             return; # nothing to do anymore if peer is already disabled
-        section_firstline = self.peers[key][self.SECTION_FIRSTLINE]
-        section_lastline = self.peers[key][self.SECTION_LASTLINE]
-        result = []
-        # Append #! to lines
-        for i, line in enumerate(self.lines):
-            prefix = ''
-            if section_firstline <= i <= section_lastline:
-                prefix = '#! '
-            result.append(prefix + line)
-        self.lines = result
-        # Invalidate data cache
-        self.invalidate_data()
+        lines, section_firstline, section_lastline = self.get_section_lines(key)
+        # Prepend #! to lines
+        for i in range(section_firstline, section_lastline + 1):
+            lines[i] = '#! ' + lines[i]
+        # Update data cache
+        self.storage.section_changed(self, key)
 
     @property
+    @_reader
     def interface(self):
         """Dictionary with interface attributes"""
-        if self._interface is None:
-            self.parse_lines()
+        self.parse_lines_if_needed()
         return self._interface
 
     @property
+    @_reader
     def peers(self):
         """Dictionary with peer data"""
-        if self._peers is None:
-            self.parse_lines()
+        self.parse_lines_if_needed()
         return self._peers
 
 
-def main():
+from .compare import diff, merge
+from .sharding import ShardedWGConfig
+from .configset import WGConfigSet
+
+
+def main(argv=None):
     """Main function"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['serve']:
+        from . import server
+        return server.main(argv[1:])
     print('This is a library to be imported into your applications.')
 
 
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Comparing WireGuard configurations"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+from . import WGConfig
+
+
+def diff_sections(data_a, data_b):
+    """Returns the changed attributes (including the disabled state) of two sections as dictionary of tuples of old and new value"""
+    result = dict()
+    for attr in set(data_a).union(data_b):
+        if attr.startswith('_') and (attr != WGConfig.SECTION_DISABLED):
+            continue
+        old, new = data_a.get(attr), data_b.get(attr)
+        if old != new:
+            result[attr] = (old, new)
+    return result
+
+def diff(a, b):
+    """Returns the changes from config "a" to config "b" (interface changes, added, removed and modified peers)"""
+    result = {'interface': dict(), 'added': [], 'removed': [], 'modified': dict()}
+    interface_a, interface_b = a.interface, b.interface
+    if interface_a.get(WGConfig.SECTION_HASH) != interface_b.get(WGConfig.SECTION_HASH):
+        result['interface'] = diff_sections(interface_a, interface_b)
+    peers_a, peers_b = a.peers, b.peers
+    for key, data_b in peers_b.items():
+        data_a = peers_a.get(key)
+        if data_a is None:
+            result['added'].append(key)
+        elif data_a[WGConfig.SECTION_HASH] != data_b[WGConfig.SECTION_HASH]: # only compare attributes in case of changes
+            result['modified'][key] = diff_sections(data_a, data_b)
+    result['removed'] = [key for key in peers_a if key not in peers_b]
+    return result
+
+def merge_section(data_base, data_ours, data_theirs):
+    """Merges the changes of "theirs" into the raw lines of "ours" attribute by attribute; returns the resulting lines and the list of conflicting attributes"""
+    lines = data_ours[WGConfig.SECTION_RAW]
+    conflicts = []
+    for attr in set(data_base).union(data_theirs):
+        if attr.startswith('_'):
+            continue
+        base, ours, theirs = data_base.get(attr), data_ours.get(attr), data_theirs.get(attr)
+        if (theirs == base) or (theirs == ours):
+            continue
+        if ours == base:
+            lines = WGConfig.set_attr_in_lines(lines, attr, theirs)
+        else:
+            conflicts.append(attr)
+    # Disabled state
+    base = data_base.get(WGConfig.SECTION_DISABLED, False)
+    ours, theirs = data_ours[WGConfig.SECTION_DISABLED], data_theirs[WGConfig.SECTION_DISABLED]
+    if (theirs != base) and (ours == base):
+        if theirs:
+            lines = ['#! ' + line for line in lines]
+        else:
+            lines = [line.replace('#! ', '', 1) for line in lines]
+    return lines, conflicts
+
+def merge(base, ours, theirs):
+    """Three-way merge of the configs "ours" and "theirs" having "base" as common ancestor; returns the merged config (with the layout of "ours") and a list of conflicts"""
+
+    def get_hash(data):
+        return None if data is None else data.get(WGConfig.SECTION_HASH)
+
+    def add_conflict(key, attr, data_base, data_ours, data_theirs):
+        conflicts.append({'key': key, 'attr': attr,
+                          'base': None if data_base is None else data_base.get(attr),
+                          'ours': None if data_ours is None else data_ours.get(attr),
+                          'theirs': None if data_theirs is None else data_theirs.get(attr)})
+
+    conflicts = []
+    peers_base, peers_ours, peers_theirs = base.peers, ours.peers, theirs.peers
+    ours_lines = ours.lines
+    lines = []
+    pos = 0
+    for section, data_ours in ours.iter_sections(ours_lines): # line indices relative to all lines whatever the storage
+        if section == 'interface':
+            key = None
+            data_base, data_theirs = base.interface or None, theirs.interface or data_ours # the interface section is never removed
+        else:
+            key = data_ours.get(ours.keyattr)
+            data_base, data_theirs = peers_base.get(key), peers_theirs.get(key)
+        lines.extend(ours_lines[pos:data_ours[WGConfig.SECTION_FIRSTLINE]])
+        pos = data_ours[WGConfig.SECTION_LASTLINE] + 1
+        section_lines = data_ours[WGConfig.SECTION_RAW]
+        if data_theirs is None: # removed by them (or added by us)
+            if data_base is not None:
+                if get_hash(data_ours) == get_hash(data_base):
+                    if (len(lines) > 0) and (len(lines[-1]) == 0):
+                        lines.pop() # also remove the blank line separating the peer
+                    continue
+                add_conflict(key, None, data_base, data_ours, data_theirs)
+        elif get_hash(data_theirs) in (get_hash(data_base), get_hash(data_ours)):
+            pass # no changes by them or same changes on both sides
+        elif get_hash(data_ours) == get_hash(data_base):
+            section_lines = theirs.get_rawdata(key) # changed by them only
+        else: # changed on both sides
+            section_lines, attrs = merge_section(data_base or dict(), data_ours, data_theirs)
+            for attr in attrs:
+                add_conflict(key, attr, data_base, data_ours, data_theirs)
+        lines.extend(section_lines)
+    lines.extend(ours_lines[pos:])
+    # Handle peers that are missing in "ours"
+    for key, data_theirs in peers_theirs.items():
+        if key in peers_ours:
+            continue
+        data_base = peers_base.get(key)
+        if data_base is None: # added by them
+            lines.append('')
+            lines.extend(theirs.get_rawdata(key))
+        elif get_hash(data_theirs) != get_hash(data_base): # removed by us but changed by them
+            add_conflict(key, None, data_base, None, data_theirs)
+    result = WGConfig(keyattr=ours.keyattr)
+    result.filename = ours.filename
+    result.lines = lines
+    result.invalidate_data()
+    return result, conflicts
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""Managing the configurations of several WireGuard interfaces with a global index of the peers"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+from .multiconfig import MultiWGConfig
+
+
+DEFAULT_DIRECTORY = '/etc/wireguard'
+
+
+class WGConfigSet(MultiWGConfig):
+    """Manages the configurations of several interfaces; a key can only be added to one of them (keys found on several interfaces are reported by "validate")"""
+
+    def __init__(self, files=None, directory=DEFAULT_DIRECTORY, max_workers=8, **kwargs):
+        """Object initialization; "files" are the files of the interfaces (e.g. ['wg0', 'wg1'], default: all "*.conf" files in the directory), further keyword arguments are passed to the WGConfig objects"""
+        MultiWGConfig.__init__(self, max_workers, **kwargs)
+        if files is None:
+            files = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if filename.endswith('.conf')]
+        for file in files:
+            self.add_config(file)
+        self.read_files()
+
+    def add_peer(self, name, key, leading_comment=None):
+        """Adds a new peer with the given (public) key to the given interface; raises KeyError if it exists on any interface"""
+        self.insert_peer(name, key, leading_comment)
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+"""Base class for wrapping the configurations of several interfaces with an index of the peers"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import collections
+import hashlib
+import io
+import os
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError: # Python2 without "futures" backport
+    ThreadPoolExecutor = None
+
+from . import WGConfig
+
+
+class MultiWGConfig():
+    """Wraps one WGConfig object per interface; an index of the peers routes operations to the interface containing the peer"""
+
+    def __init__(self, max_workers=8, **kwargs):
+        """Object initialization; keyword arguments are passed to the WGConfig objects"""
+        self.max_workers = max_workers
+        self.config_kwargs = kwargs
+        self.configs = collections.OrderedDict() # interface name -> WGConfig
+        self.index = dict() # peer key -> interface name
+        self.conflicts = dict() # peer key -> set of names of all interfaces containing it (if more than one)
+        self.modified = set() # names of interfaces changed in memory
+
+    @staticmethod
+    def get_name(filename):
+        """Returns the interface name belonging to the given filename"""
+        name = os.path.basename(filename)
+        return name[:-len('.conf')] if name.endswith('.conf') else name
+
+    def add_config(self, file):
+        """Adds a (not yet read) configuration for the given file; returns its name"""
+        wc = WGConfig(file, **self.config_kwargs)
+        name = self.get_name(wc.filename)
+        if name in self.configs:
+            raise ValueError('Duplicate interface [{0}]'.format(name))
+        self.configs[name] = wc
+        return name
+
+    def add_to_index(self, name):
+        """Adds the peers of the given interface to the index; a peer existing on another interface is recorded in the conflicts (see "validate")"""
+        for key in self.configs[name].get_peers(include_disabled=True):
+            if key in self.index:
+                self.conflicts.setdefault(key, set([self.index[key]])).add(name)
+            else:
+                self.index[key] = name
+
+    def remove_from_index(self, key, name):
+        """Removes the given interface from the index entry of the peer with the given key; another interface containing it takes over"""
+        names = self.conflicts.get(key)
+        if names is None:
+            del self.index[key]
+            return
+        names.discard(name)
+        if self.index[key] == name:
+            self.index[key] = [other for other in self.configs if other in names][0]
+        if len(names) == 1:
+            del self.conflicts[key]
+
+    @staticmethod
+    def load(wc):
+        """Reads and parses the file of the given configuration (run in a worker thread)"""
+        wc.read_file()
+        wc.parse_lines_if_needed()
+
+    def read_files(self):
+        """Reads and parses the files of all interfaces in a thread pool and rebuilds the index; missing files are to be created"""
+        names = [name for name, wc in self.configs.items() if os.path.exists(wc.filename)]
+        if (ThreadPoolExecutor is None) or (len(names) <= 1):
+            for name in names:
+                self.load(self.configs[name])
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names))) as executor:
+                list(executor.map(self.load, [self.configs[name] for name in names]))
+        self.index = dict()
+        self.conflicts = dict()
+        for name in self.configs:
+            self.add_to_index(name)
+        self.modified = set(name for name in self.configs if name not in names)
+
+    def read_file(self, name):
+        """Reads the file of the given interface and updates the index and the conflicts for its peers only"""
+        keys = [key for key, interface in self.index.items() if interface == name]
+        keys.extend(key for key, names in self.conflicts.items() if (name in names) and (self.index[key] != name))
+        for key in keys:
+            self.remove_from_index(key, name)
+        self.load(self.configs[name])
+        self.add_to_index(name)
+        self.modified.discard(name)
+
+    def write_files(self):
+        """Writes the files of all interfaces that changed; returns the names of the written interfaces"""
+        written = []
+        for name in sorted(self.modified):
+            wc = self.configs[name]
+            if wc.file_signature is not None:
+                fobj = io.StringIO()
+                wc.write_to_fileobj(fobj)
+                if hashlib.sha256(fobj.getvalue().encode('utf-8')).hexdigest() == wc.file_signature[2]:
+                    continue # changed back to the content of the file
+            wc.write_file()
+            written.append(name)
+        self.modified = set()
+        return written
+
+    def validate(self):
+        """Validates the configurations of all interfaces and reports peers existing on more than one interface; returns a list of problems (see "WGConfig.validate", each with the name of its "interface")"""
+        problems = []
+        for name, wc in self.configs.items():
+            for problem in wc.validate():
+                problem['interface'] = name
+                problems.append(problem)
+        for key, names in sorted(self.conflicts.items()):
+            for name in self.configs:
+                if (name in names) and (name != self.index[key]):
+                    problems.append({'interface': name, 'key': key, 'attr': self.configs[name].keyattr, 'value': key,
+                                     'message': 'peer also exists on interface {0}'.format(self.index[key])})
+        return problems
+
+    def get_interface_name(self, key):
+        """Returns the name of the interface containing the peer with the given key"""
+        try:
+            return self.index[key]
+        except KeyError:
+            raise KeyError('The peer does not exist')
+
+    def get_config(self, key):
+        """Returns the configuration of the interface containing the peer with the given key"""
+        return self.configs[self.get_interface_name(key)]
+
+    def get_section(self, key):
+        """Returns a tuple of interface name and parsed section data of the peer with the given key"""
+        name = self.get_interface_name(key)
+        return name, self.configs[name].peers[key]
+
+    def get_peers(self, keys_only=True, include_disabled=False, include_details=False):
+        """Returns peer data or a list of peers (i.e. their public keys) of all interfaces"""
+        if keys_only:
+            result = []
+            for wc in self.configs.values():
+                result.extend(wc.get_peers(keys_only, include_disabled, include_details))
+        else:
+            result = dict()
+            for wc in self.configs.values():
+                result.update(wc.get_peers(keys_only, include_disabled, include_details))
+        return result
+
+    def get_peer(self, key, include_details=False):
+        """Returns the data of the peer with the given (public) key"""
+        return self.get_config(key).get_peer(key, include_details)
+
+    def get_peer_enabled(self, key):
+        """Checks whether the peer with the given (public) key is enabled"""
+        return self.get_config(key).get_peer_enabled(key)
+
+    def insert_peer(self, name, key, leading_comment=None):
+        """Adds a new peer with the given (public) key to the given interface; raises KeyError if it exists on any interface"""
+        if key in self.index:
+            raise KeyError('Peer to be added already exists on interface [{0}]'.format(self.index[key]))
+        self.configs[name].add_peer(key, leading_comment)
+        self.index[key] = name
+        self.modified.add(name)
+
+    def del_peer(self, key):
+        """Removes the peer with the given (public) key"""
+        if key not in self.index:
+            raise KeyError('The peer to be deleted does not exist')
+        name = self.index[key]
+        self.configs[name].del_peer(key)
+        self.remove_from_index(key, name)
+        self.modified.add(name)
+
+    def move_peer(self, key, name):
+        """Moves the peer with the given (public) key including its comments to the given interface"""
+        source_name = self.get_interface_name(key)
+        if source_name == name:
+            return
+        source = self.configs[source_name]
+        self.configs[name].add_section_lines(source.get_rawdata(key))
+        source.del_peer(key)
+        self.index[key] = name
+        if key in self.conflicts:
+            self.conflicts[key].discard(source_name)
+            self.conflicts[key].add(name)
+            if len(self.conflicts[key]) == 1:
+                del self.conflicts[key]
+        self.modified.update([source_name, name])
+
+    def modify_peer(self, method, key, *args, **kwargs):
+        """Calls the given WGConfig method for the peer with the given key on its interface"""
+        name = self.get_interface_name(key)
+        result = getattr(self.configs[name], method)(key, *args, **kwargs)
+        self.modified.add(name)
+        return result
+
+    def add_attr(self, key, attr, value, leading_comment=None, append_as_line=False):
+        """Adds an attribute/value pair to the given peer"""
+        return self.modify_peer('add_attr', key, attr, value, leading_comment, append_as_line)
+
+    def del_attr(self, key, attr, value=None, remove_leading_comments=True):
+        """Removes an attribute/value pair from the given peer"""
+        return self.modify_peer('del_attr', key, attr, value, remove_leading_comments)
+
+    def set_attr(self, key, attr, value):
+        """Sets an attribute of the given peer to the given value, replacing the existing line"""
+        return self.modify_peer('set_attr', key, attr, value)
+
+    def update_peers(self, changes):
+        """Sets attributes of many peers with a single pass per interface (see "WGConfig.update_peers")"""
+        grouped = dict() # interface name -> changes
+        for key, attrs in changes.items():
+            grouped.setdefault(self.get_interface_name(key), dict())[key] = attrs
+        for name, interface_changes in grouped.items():
+            self.configs[name].update_peers(interface_changes)
+            self.modified.add(name)
+
+    def enable_peer(self, key):
+        """Enables the peer with the given (public) key"""
+        return self.modify_peer('enable_peer', key)
+
+    def disable_peer(self, key):
+        """Disables the peer with the given (public) key"""
+        return self.modify_peer('disable_peer', key)
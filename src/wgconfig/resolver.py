@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""Resolution of the hostnames in the endpoints of peers, concurrently and with caching"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import ipaddress
+import socket
+import threading
+import time
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError: # Python2 without "futures" backport
+    ThreadPoolExecutor = None
+
+from . import WGConfig
+from .views import SectionView
+
+
+def resolve_host(host):
+    """Resolves the given hostname to an IP address (string) using the system resolver; raises an OSError if not possible"""
+    addresses = socket.getaddrinfo(host, None, 0, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    if len(addresses) == 0:
+        raise OSError('No address found for [{0}]'.format(host))
+    return addresses[0][4][0]
+
+
+class EndpointResolver():
+    """Resolves the hostnames of endpoints with a cache of results (also of failures) and in parallel threads"""
+
+    def __init__(self, resolve=resolve_host, ttl=300, negative_ttl=30, max_workers=16, clock=time.time):
+        """Object initialization; "resolve" is a function mapping a hostname to an IP address (raising an exception on failure)"""
+        self.resolve = resolve
+        self.ttl = ttl # seconds to cache a resolved address
+        self.negative_ttl = negative_ttl # seconds to cache a failed resolution
+        self.max_workers = max_workers
+        self.clock = clock
+        self.cache = dict() # hostname -> tuple of address ("None" on failure) and expiry time
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def is_address(host):
+        """Checks whether the given host is an IP address already"""
+        try:
+            ipaddress.ip_address(str(host))
+        except ValueError:
+            return False
+        return True
+
+    def resolve_cached(self, host):
+        """Returns the address of the given host ("None" if not resolvable) using the cache"""
+        now = self.clock()
+        with self._cache_lock:
+            cached = self.cache.get(host)
+        if (cached is not None) and (cached[1] > now):
+            return cached[0]
+        try:
+            address = self.resolve(host)
+            expiry = now + self.ttl
+        except Exception:
+            address = None
+            expiry = now + self.negative_ttl
+        with self._cache_lock:
+            self.cache[host] = (address, expiry)
+        return address
+
+    def resolve_hosts(self, hosts):
+        """Resolves the given hostnames concurrently; returns a dictionary of hostname and address ("None" if not resolvable)"""
+        hosts = list(set(hosts))
+        if (ThreadPoolExecutor is None) or (len(hosts) <= 1):
+            return {host: self.resolve_cached(host) for host in hosts}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(hosts))) as executor:
+            return dict(zip(hosts, executor.map(self.resolve_cached, hosts)))
+
+    @staticmethod
+    def get_endpoint_hosts(wc):
+        """Returns a dictionary of peer key and endpoint host of the enabled peers of the given config having a hostname as endpoint"""
+        result = dict()
+        for key, peer in wc.get_peers(keys_only=False, fields=['Endpoint']).items():
+            if peer.get('Endpoint') is None:
+                continue
+            host, _port = SectionView.split_endpoint(peer['Endpoint'])
+            if not EndpointResolver.is_address(host):
+                result[key] = host
+        return result
+
+    def resolve_config(self, wc):
+        """Returns a copy of the given config with hostnames in endpoints replaced by addresses and a list of the hosts that could not be resolved
+
+        The endpoints of peers whose host could not be resolved are removed from the copy.
+        """
+        hosts = self.get_endpoint_hosts(wc)
+        addresses = self.resolve_hosts(hosts.values())
+        lines = list(wc.lines)
+        # Replace the lines of the affected sections, from the last section to the first one to keep the indices valid
+        sections = [(section, section_data) for section, section_data in wc.iter_sections(lines, include_raw=False)
+                    if (section_data.get(wc.keyattr) in hosts) and not section_data[WGConfig.SECTION_DISABLED]]
+        for section, section_data in reversed(sections):
+            key = section_data[wc.keyattr]
+            address = addresses[hosts[key]]
+            if address is None:
+                endpoint = None
+            else:
+                _host, port = SectionView.split_endpoint(section_data['Endpoint'])
+                endpoint = ('[{0}]:{1}' if ':' in address else '{0}:{1}').format(address, port)
+            firstline, lastline = section_data[WGConfig.SECTION_FIRSTLINE], section_data[WGConfig.SECTION_LASTLINE]
+            lines[firstline:lastline + 1] = WGConfig.set_attr_in_lines(lines[firstline:lastline + 1], 'Endpoint', endpoint)
+        result = WGConfig(keyattr=wc.keyattr)
+        result.lines = lines
+        result.invalidate_data()
+        return result, sorted(set(host for host, address in addresses.items() if address is None))
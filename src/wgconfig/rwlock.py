@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""Reader/writer lock allowing many concurrent readers and one exclusive writer"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import contextlib
+import threading
+
+
+class ReadWriteLock():
+    """A reader/writer lock that prefers writers; reentrant for readers and writers, and the writer may also read"""
+
+    def __init__(self):
+        """Object initialization"""
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = dict() # reading thread -> recursion count
+        self._writer = None # writing thread
+        self._writer_count = 0 # recursion count of writing thread
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        """Acquires the lock for reading"""
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me: # the writer may read as well
+                self._writer_count += 1
+                return
+            if me in self._readers:
+                self._readers[me] += 1
+                return
+            while (self._writer is not None) or (self._writers_waiting > 0):
+                self._cond.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        """Releases the lock acquired for reading"""
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self._writer_count -= 1
+                return
+            self._readers[me] -= 1
+            if self._readers[me] == 0:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """Acquires the lock for exclusive writing"""
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self._writer_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError('A read lock cannot be upgraded to a write lock')
+            self._writers_waiting += 1
+            try:
+                while (self._writer is not None) or (len(self._readers) > 0):
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_count = 1
+
+    def release_write(self):
+        """Releases the lock acquired for writing"""
+        with self._cond:
+            if self._writer is not threading.current_thread():
+                raise RuntimeError('The write lock is not held by this thread')
+            self._writer_count -= 1
+            if self._writer_count == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def read_locked(self):
+        """Context manager for holding the lock for reading"""
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_locked(self):
+        """Context manager for holding the lock for writing"""
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+"""Daemon keeping parsed WireGuard configurations in memory and serving them over a Unix domain socket
+
+Protocol: each request is a single line with a JSON object {"op": ..., "interface": ..., "args": {...}} or a
+JSON list of such objects (batch). The response is a single line with a JSON object {"result": ...} or
+{"error": ..., "type": ...} per request (a list for batches). All changes of a batch are written with one
+write per configuration file.
+"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import logging
+import os
+import socket
+import threading
+try:
+    import socketserver
+except ImportError: # Python2
+    import SocketServer as socketserver
+
+from . import WGConfig, ConcurrentModificationError
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = '/etc/wireguard'
+DEFAULT_SOCKET = '/run/wgconfig.sock'
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles the requests of a client connection, one request or batch per line"""
+
+    def handle(self):
+        """Answers the requests of the client until the connection is closed"""
+        for line in self.rfile:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                response = self.server.error_response(e)
+            else:
+                if isinstance(request, list):
+                    response = self.server.handle_batch(request)
+                else:
+                    response = self.server.handle_batch([request])[0]
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ConfigServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves the WireGuard configurations of a directory; configurations are parsed once and reloaded when their file changes"""
+    READ_OPS = ['get_interface', 'get_peers', 'get_peer', 'get_peer_enabled']
+    WRITE_OPS = ['add_peer', 'del_peer', 'add_attr', 'del_attr', 'set_attr', 'update_peers', 'enable_peer', 'disable_peer']
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, directory=DEFAULT_DIRECTORY, **kwargs):
+        """Object initialization; further keyword arguments are passed to the WGConfig objects"""
+        self.socket_path = socket_path
+        self.directory = directory
+        self.config_kwargs = kwargs
+        self.configs = dict() # interface name -> WGConfig
+        self.write_lock = threading.RLock() # serializes loading and modifying configurations
+        if os.path.exists(socket_path): # remove stale socket of a previous run
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        """Closes the socket and removes the socket file"""
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def list_interfaces(self):
+        """Returns the names of the interfaces that have a configuration file"""
+        return sorted(filename[:-len('.conf')] for filename in os.listdir(self.directory) if filename.endswith('.conf'))
+
+    def get_config(self, interface, pinned=None):
+        """Returns the configuration of the given interface, (re)reading the file if not loaded yet or changed; configurations in "pinned" (dictionary of name and WGConfig) are never reloaded"""
+        if (interface is None) or (os.path.basename(interface) != interface):
+            raise ValueError('A valid interface name needs to be provided')
+        if (pinned is not None) and (interface in pinned):
+            return pinned[interface] # keep changes made earlier in the batch; writing fails if the file changed meanwhile
+        wc = self.load_config(interface)
+        if pinned is not None:
+            pinned[interface] = wc
+        return wc
+
+    def load_config(self, interface):
+        """Returns the configuration of the given interface, (re)reading the file if not loaded yet or changed"""
+        wc = self.configs.get(interface)
+        if (wc is not None) and not wc.file_changed(wc.filename):
+            return wc
+        with self.write_lock:
+            wc = self.configs.get(interface)
+            if wc is None:
+                filename = os.path.join(self.directory, interface + '.conf')
+                if not os.path.exists(filename):
+                    raise KeyError('The interface [{0}] does not exist'.format(interface))
+                wc = WGConfig(filename, threadsafe=True, **self.config_kwargs)
+                wc.read_file()
+                self.configs[interface] = wc
+            elif wc.file_changed(wc.filename):
+                logger.info('Reloading changed configuration [{0}]'.format(wc.filename))
+                wc.read_file()
+        return wc
+
+    @staticmethod
+    def error_response(e):
+        """Returns the response for the given exception"""
+        message = e.args[0] if (isinstance(e, KeyError) and len(e.args) > 0) else str(e)
+        return {'error': message, 'type': e.__class__.__name__}
+
+    def call(self, request, pinned=None):
+        """Executes a single request on the in-memory configuration and returns its result"""
+        op = request.get('op')
+        if op == 'list':
+            return self.list_interfaces()
+        if op not in self.READ_OPS and op not in self.WRITE_OPS:
+            raise ValueError('Unknown operation [{0}]'.format(op))
+        args = request.get('args', dict())
+        if not isinstance(args, dict):
+            raise ValueError('The arguments need to be given as object')
+        return getattr(self.get_config(request.get('interface'), pinned), op)(**args)
+
+    def handle_batch(self, requests):
+        """Executes the given requests in order and returns the list of responses; modified configurations are written once at the end"""
+        responses = []
+        if not any(isinstance(request, dict) and (request.get('op') in self.WRITE_OPS) for request in requests):
+            for request in requests:
+                try:
+                    if not isinstance(request, dict):
+                        raise ValueError('A request needs to be an object')
+                    responses.append({'result': self.call(request)})
+                except Exception as e:
+                    responses.append(self.error_response(e))
+            return responses
+        with self.write_lock:
+            modified = collections.OrderedDict() # interface name -> indices of successful modifying requests
+            pinned = dict() # interface name -> configuration used for the whole batch
+            for request in requests:
+                try:
+                    if not isinstance(request, dict):
+                        raise ValueError('A request needs to be an object')
+                    responses.append({'result': self.call(request, pinned)})
+                    if request['op'] in self.WRITE_OPS:
+                        modified.setdefault(request['interface'], []).append(len(responses) - 1)
+                except Exception as e:
+                    responses.append(self.error_response(e))
+            for interface, indices in modified.items():
+                wc = pinned[interface]
+                try:
+                    wc.write_file(check_unchanged=True)
+                except (ConcurrentModificationError, OSError) as e:
+                    # The file could not be written (e.g. changed by another process meanwhile): discard the changes
+                    wc.read_file()
+                    for index in indices:
+                        responses[index] = self.error_response(e)
+        return responses
+
+
+class ConfigClient():
+    """Client for sending requests to a ConfigServer"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        """Object initialization"""
+        self.socket_path = socket_path
+        self.sock = None
+        self.sockfile = None
+
+    def connect(self):
+        """Connects to the server unless already connected"""
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.socket_path)
+            self.sockfile = self.sock.makefile('rwb')
+
+    def close(self):
+        """Closes the connection to the server"""
+        if self.sock is not None:
+            self.sockfile.close()
+            self.sock.close()
+            self.sock = None
+            self.sockfile = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def send(self, data):
+        """Sends the given request or batch of requests and returns the response"""
+        self.connect()
+        self.sockfile.write(json.dumps(data).encode('utf-8') + b'\n')
+        self.sockfile.flush()
+        line = self.sockfile.readline()
+        if len(line) == 0:
+            raise ConnectionError('The server closed the connection')
+        return json.loads(line.decode('utf-8'))
+
+    @staticmethod
+    def get_result(response):
+        """Returns the result of the given response or raises an exception for an error response"""
+        if 'error' in response:
+            exception_class = {'KeyError': KeyError, 'ValueError': ValueError, 'TypeError': TypeError}.get(response.get('type'), RuntimeError)
+            raise exception_class(response['error'])
+        return response['result']
+
+    def request(self, op, interface=None, **args):
+        """Executes the given operation (a method name of WGConfig) with the given arguments on the server and returns the result"""
+        return self.get_result(self.send({'op': op, 'interface': interface, 'args': args}))
+
+    def batch(self, requests):
+        """Executes the given list of tuples of operation, interface and arguments dictionary in one round trip; returns the list of responses"""
+        return self.send([{'op': op, 'interface': interface, 'args': args} for op, interface, args in requests])
+
+
+def main(argv=None):
+    """Runs the server until interrupted"""
+    parser = argparse.ArgumentParser(prog='wgconfig serve', description='Serves parsed WireGuard configurations over a Unix domain socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='path of the Unix domain socket (default: %(default)s)')
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY, help='directory of the configuration files (default: %(default)s)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    server = ConfigServer(args.socket, args.directory)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
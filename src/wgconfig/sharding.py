@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Spreading a large set of peers over several WireGuard interfaces (shards) using consistent hashing"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import bisect
+import hashlib
+import os
+
+from .multiconfig import MultiWGConfig
+
+
+class ShardedWGConfig(MultiWGConfig):
+    """Wraps one WGConfig object per shard; peers are placed by consistent hashing of their public key"""
+    REPLICAS = 100 # points per shard on the hash ring
+
+    def __init__(self, files, replicas=REPLICAS, **kwargs):
+        """Object initialization; "files" are the files of the shards (e.g. ['wg0', 'wg1']), further keyword arguments are passed to the WGConfig objects"""
+        MultiWGConfig.__init__(self, **kwargs)
+        self.replicas = replicas
+        self.ring = [] # sorted list of tuples of hash and shard name
+        for file in files:
+            self.add_shard(file, rebalance=False)
+
+    @property
+    def shards(self):
+        """Dictionary of shard name and WGConfig object"""
+        return self.configs
+
+    @staticmethod
+    def get_hash(value):
+        """Returns the position of the given string on the hash ring"""
+        return int(hashlib.sha1(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    def add_shard(self, file, rebalance=True):
+        """Adds a shard for the given file and (optionally) moves the peers that now belong to it; returns the shard name"""
+        name = self.add_config(file)
+        for i in range(self.replicas):
+            bisect.insort(self.ring, (self.get_hash('{0}#{1}'.format(name, i)), name))
+        if os.path.exists(self.configs[name].filename):
+            self.read_file(name)
+        else:
+            self.modified.add(name)
+        if rebalance:
+            self.rebalance()
+        return name
+
+    def get_shard_name(self, key):
+        """Returns the name of the shard a peer with the given key is placed on"""
+        if len(self.ring) == 0:
+            raise ValueError('There are no shards')
+        position = bisect.bisect(self.ring, (self.get_hash(key),))
+        return self.ring[position % len(self.ring)][1]
+
+    def rebalance(self):
+        """Moves all peers not on the shard they are placed on by consistent hashing; returns the number of moved peers"""
+        moved = 0
+        for key, name in list(self.index.items()):
+            target = self.get_shard_name(key)
+            if target != name:
+                self.move_peer(key, target)
+                moved += 1
+        return moved
+
+    def add_peer(self, key, leading_comment=None):
+        """Adds a new peer with the given (public) key to the shard it is placed on"""
+        self.insert_peer(self.get_shard_name(key), key, leading_comment)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""Read-only snapshots of parsed configurations in shared memory for use by many processes
+
+Layout (little endian):
+    header: magic, version, number of peers, number of enabled peers, key width,
+            offset and length of the interface record, offset of the key table, offsets of the two order tables
+    key table: per peer (sorted by key) the key padded to the key width, offset and length of its record, disabled flag
+    order tables: indices into the key table of all peers and of the enabled peers in file order
+    records: parsed section data as JSON (without "_rawdata")
+"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import json
+import struct
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError: # Python < 3.8
+    shared_memory = None
+
+from . import WGConfig
+
+
+MAGIC = b'WGSM'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIIQQQQQ')
+ORDER_ITEM = struct.Struct('<I')
+
+
+class SharedConfig():
+    """Read-only view of a configuration published in shared memory; lookups decode only the requested records"""
+
+    def __init__(self, shm, owner=False):
+        """Object initialization; use "publish" or "attach" for getting instances"""
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        (magic, version, self.count, self.enabled_count, self.keywidth, self.interface_offset, self.interface_length,
+         self.table_offset, self.order_offset, self.enabled_order_offset) = HEADER.unpack_from(self.buf, 0)
+        if (magic != MAGIC) or (version != VERSION):
+            raise ValueError('The shared memory does not contain a configuration snapshot')
+        self.entry = struct.Struct('<{0}sQIB'.format(self.keywidth))
+
+    @property
+    def name(self):
+        """Name of the shared memory block (to be passed to "attach")"""
+        return self.shm.name
+
+    @staticmethod
+    def encode(section_data):
+        """Returns the given section data as bytes"""
+        data = {attr: value for attr, value in section_data.items() if attr != WGConfig.SECTION_RAW}
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    @classmethod
+    def publish(cls, wc, name=None):
+        """Writes a snapshot of the given configuration into a new shared memory block; the returned owner needs to call "unlink" when done"""
+        if shared_memory is None:
+            raise RuntimeError('Shared memory requires Python 3.8 or newer')
+        interface = cls.encode(wc.interface)
+        keys = wc.get_peers(include_disabled=True) # file order
+        enabled = set(wc.get_peers())
+        records = [cls.encode(wc.peers[key]) for key in keys]
+        encoded_keys = [key.encode('utf-8') for key in keys]
+        keywidth = max([len(key) for key in encoded_keys] + [1])
+        entry = struct.Struct('<{0}sQIB'.format(keywidth))
+        # Compute offsets of the parts
+        table_offset = HEADER.size
+        order_offset = table_offset + len(keys) * entry.size
+        enabled_order_offset = order_offset + len(keys) * ORDER_ITEM.size
+        interface_offset = enabled_order_offset + len(enabled) * ORDER_ITEM.size
+        record_offset = interface_offset + len(interface)
+        size = record_offset + sum(len(record) for record in records)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+        buf = shm.buf
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, len(keys), len(enabled), keywidth, interface_offset, len(interface),
+                         table_offset, order_offset, enabled_order_offset)
+        buf[interface_offset:record_offset] = interface
+        # Records in file order, key table sorted by key
+        offsets = []
+        for record in records:
+            buf[record_offset:record_offset + len(record)] = record
+            offsets.append(record_offset)
+            record_offset += len(record)
+        sorted_indices = sorted(range(len(keys)), key=lambda i: encoded_keys[i].ljust(keywidth, b'\0'))
+        table_positions = dict()
+        for position, i in enumerate(sorted_indices):
+            entry.pack_into(buf, table_offset + position * entry.size, encoded_keys[i], offsets[i], len(records[i]), keys[i] not in enabled)
+            table_positions[i] = position
+        enabled_position = 0
+        for i, key in enumerate(keys):
+            ORDER_ITEM.pack_into(buf, order_offset + i * ORDER_ITEM.size, table_positions[i])
+            if key in enabled:
+                ORDER_ITEM.pack_into(buf, enabled_order_offset + enabled_position * ORDER_ITEM.size, table_positions[i])
+                enabled_position += 1
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to the snapshot in the shared memory block with the given name without copying it"""
+        if shared_memory is None:
+            raise RuntimeError('Shared memory requires Python 3.8 or newer')
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError: # Python < 3.13: stop the resource tracker from removing the block when this process exits
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    def close(self):
+        """Detaches from the shared memory block"""
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """Detaches from and removes the shared memory block (owner only)"""
+        self.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+    def get_entry(self, position):
+        """Returns key, record offset, record length and disabled flag of the given position in the key table"""
+        key, offset, length, disabled = self.entry.unpack_from(self.buf, self.table_offset + position * self.entry.size)
+        return key.rstrip(b'\0').decode('utf-8'), offset, length, bool(disabled)
+
+    def find(self, key):
+        """Returns the position of the given key in the key table (binary search; "None" if not found)"""
+        wanted = key.encode('utf-8')
+        if len(wanted) > self.keywidth:
+            return None
+        wanted = wanted.ljust(self.keywidth, b'\0')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            current = bytes(self.buf[self.table_offset + middle * self.entry.size:self.table_offset + middle * self.entry.size + self.keywidth])
+            if current < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        if (low < self.count) and (self.get_entry(low)[0] == key):
+            return low
+        return None
+
+    def decode(self, offset, length):
+        """Returns the section data stored at the given offset"""
+        return json.loads(bytes(self.buf[offset:offset + length]).decode('utf-8'))
+
+    def get_interface(self, include_details=False):
+        """Returns the data of the interface section"""
+        data = self.decode(self.interface_offset, self.interface_length)
+        return data if include_details else {attr: value for attr, value in data.items() if not attr.startswith('_')}
+
+    def get_peer(self, key, include_details=False):
+        """Returns the data of the peer with the given (public) key"""
+        position = self.find(key)
+        if position is None:
+            raise KeyError('The peer does not exist')
+        _key, offset, length, _disabled = self.get_entry(position)
+        data = self.decode(offset, length)
+        return data if include_details else {attr: value for attr, value in data.items() if not attr.startswith('_')}
+
+    def get_peer_enabled(self, key):
+        """Checks whether the peer with the given (public) key is enabled"""
+        position = self.find(key)
+        if position is None:
+            raise KeyError('The peer does not exist')
+        return not self.get_entry(position)[3]
+
+    def get_peers(self, keys_only=True, include_disabled=False, include_details=False, fields=None, offset=0, limit=None):
+        """Returns peer data or a list of peers (i.e. their public keys) in file order, optionally paginated and projected"""
+        count, order_offset = (self.count, self.order_offset) if include_disabled else (self.enabled_count, self.enabled_order_offset)
+        stop = count if limit is None else min(count, offset + limit)
+        entries = [self.get_entry(ORDER_ITEM.unpack_from(self.buf, order_offset + i * ORDER_ITEM.size)[0]) for i in range(offset, stop)]
+        if keys_only:
+            return [entry[0] for entry in entries]
+        result = dict()
+        for key, record_offset, length, _disabled in entries:
+            data = self.decode(record_offset, length)
+            if fields is not None:
+                data = {field: data[field] for field in fields if field in data}
+            elif not include_details:
+                data = {attr: value for attr, value in data.items() if not attr.startswith('_')}
+            result[key] = data
+        return result
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+
+"""Storage of the lines of a WireGuard configuration in memory"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import collections
+import itertools
+import re
+import sqlite3
+try:
+    from collections.abc import MutableMapping
+except ImportError: # Python2
+    from collections import MutableMapping
+
+
+def split_peer_keys(config, keys):
+    """Returns a tuple of the given peer keys and of the keys of the enabled peers among them"""
+    keys = list(keys)
+    return keys, [key for key in keys if not config._peers[key].get(config.SECTION_DISABLED, False)]
+
+
+class CommentIndex():
+    """Index of the words in the leading comments of peer sections"""
+
+    def __init__(self, config=None, peers=None):
+        """Object initialization; indexes the given peers (dictionary of key and section data)"""
+        self.config = config
+        self.words = dict() # word -> set of keys of peers having it in their leading comment
+        for key, section_data in (dict() if peers is None else peers).items():
+            self.add(key, section_data)
+
+    @staticmethod
+    def get_words(text):
+        """Returns the set of (lower case) words in the given text"""
+        return set(re.findall(r'\w+', text.lower()))
+
+    def add(self, key, section_data):
+        """Adds the leading comment of the given section to the index"""
+        for word in self.get_words(section_data.get(self.config.SECTION_COMMENT, '')):
+            self.words.setdefault(word, set()).add(key)
+
+    def remove(self, key, section_data):
+        """Removes the leading comment of the given section from the index"""
+        for word in self.get_words(section_data.get(self.config.SECTION_COMMENT, '')):
+            keys = self.words.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.words[word]
+
+    def find(self, text):
+        """Returns the set of keys of the peers having all words of the given text in their leading comment"""
+        result = None
+        for word in self.get_words(text):
+            keys = self.words.get(word, set())
+            result = set(keys) if result is None else result & keys
+            if len(result) == 0:
+                break
+        return set() if result is None else result
+
+
+class LineStorage():
+    """Stores all lines in a single list (default); any change invalidates all parsed data"""
+
+    def __init__(self, lines=None):
+        """Object initialization"""
+        self.lines = [] if lines is None else lines
+        self.duplicate_keys = set() # keys of peers occurring more than once
+        self.peer_keys = None # cached tuple of lists of keys of all and of enabled peers in file order
+        self.comment_index = None # index of leading comments, built on first use
+
+    def get_lines(self, config):
+        """Returns the list of all lines"""
+        return self.lines
+
+    def set_lines(self, config, lines):
+        """Replaces all lines"""
+        self.lines = lines
+
+    def iter_lines(self, config):
+        """Yields all lines in file order"""
+        return iter(self.lines)
+
+    def iter_sections(self, config, include_raw=True):
+        """Yields a tuple of section name and section data per section in file order"""
+        return config.iter_sections(self.lines, include_raw)
+
+    def parse(self, config):
+        """Parses all lines and returns the interface data and the dictionary of peer data"""
+        interface = dict()
+        peers = dict()
+        self.duplicate_keys = set()
+        self.peer_keys = None
+        self.comment_index = None
+        for section, section_data in self.iter_sections(config, include_raw=not config.compact):
+            if section == 'interface':
+                interface = section_data
+            else:
+                key = section_data.get(config.keyattr)
+                if key in peers:
+                    self.duplicate_keys.add(key)
+                peers[key] = section_data
+        return interface, peers
+
+    def get_peer_keys(self, config, include_disabled=False):
+        """Returns the (cached) list of the keys of the peers in file order; the data needs to be parsed already"""
+        if self.peer_keys is None:
+            self.peer_keys = split_peer_keys(config, config._peers)
+        return self.peer_keys[0 if include_disabled else 1]
+
+    def get_comment_index(self, config):
+        """Returns the index of the leading comments of the peers; the data needs to be parsed already"""
+        if self.comment_index is None:
+            self.comment_index = CommentIndex(config, config._peers)
+        return self.comment_index
+
+    def get_section_lines(self, config, key, modify=True):
+        """Returns the list of lines that contains the section with the given key ("None" for the interface section)"""
+        return self.lines
+
+    def section_changed(self, config, key):
+        """Updates the parsed data after the lines of the section with the given key have been changed in place"""
+        config.invalidate_data()
+
+    def add_section(self, config, lines):
+        """Appends the given lines of a new section (including a separating blank line)"""
+        self.lines.extend(lines)
+        config.invalidate_data()
+
+    def update_sections(self, config, updates):
+        """Replaces the lines of the sections given by a dictionary of key and function returning new lines for the current ones, in one pass"""
+        sections = sorted((config.get_sectioninfo(key), func) for key, func in updates.items())
+        result = []
+        start = 0
+        for (section_firstline, section_lastline), func in sections:
+            result.extend(self.lines[start:section_firstline])
+            result.extend(func(self.lines[section_firstline:(section_lastline + 1)]))
+            start = section_lastline + 1
+        result.extend(self.lines[start:])
+        self.lines = result
+        config.invalidate_data()
+
+    def remove_section(self, config, key):
+        """Removes the peer section with the given key including a blank line directly before it"""
+        section_firstline, section_lastline = config.get_sectioninfo(key)
+        # Remove a blank line directly before the peer section
+        if section_firstline > 0:
+            if len(self.lines[section_firstline - 1]) == 0:
+                section_firstline -= 1
+        # Only keep needed lines
+        result = []
+        if section_firstline > 0:
+            result.extend(self.lines[0:section_firstline])
+        result.extend(self.lines[(section_lastline + 1):])
+        self.lines = result
+        config.invalidate_data()
+
+    def share(self):
+        """Returns a new storage object sharing the data with this one; "unshare" needs to be called on both before any modification"""
+        other = self.__class__(self.lines)
+        other.duplicate_keys = self.duplicate_keys # belongs to the shared parsed data
+        return other
+
+    def unshare(self):
+        """Stops sharing data with other storage objects by copying it"""
+        self.lines = list(self.lines)
+        self.duplicate_keys = set(self.duplicate_keys)
+
+
+class BlockStorage():
+    """Stores the lines in one block per section so that changes are local to a section
+
+    A block starts with the blank lines separating the section from the previous one. The line indices in the
+    parsed section data ("_index_firstline", "_index_lastline") are relative to the block of the section.
+    """
+
+    def __init__(self):
+        """Object initialization"""
+        self.blocks = collections.OrderedDict() # block id -> list of lines
+        self.block_ids = itertools.count()
+        self.owned = None # ids of blocks not shared with other storage objects ("None" if nothing is shared)
+        self.interface_block = None # id of the block of the interface section
+        self.peer_blocks = dict() # peer key -> id of the block of the peer section
+        self.block_keys = dict() # block id -> list of peer keys of the sections in the block
+        self.duplicate_keys = set() # keys of peers occurring more than once
+        self.peer_keys = None # cached tuple of lists of keys of all and of enabled peers in file order
+        self.comment_index = None # index of leading comments, built on first use and then updated per block
+
+    def get_lines(self, config):
+        """Returns a list of all lines (changes to this list have no effect)"""
+        return list(self.iter_lines(config))
+
+    def create_blocks(self):
+        """Returns a new empty mapping of block ids to blocks"""
+        return collections.OrderedDict()
+
+    def set_lines(self, config, lines):
+        """Replaces all lines, splitting them into blocks"""
+        blocks = []
+        start = 0
+        for section, section_data in config.iter_sections(lines, include_raw=False):
+            lastline = section_data[config.SECTION_LASTLINE]
+            blocks.append(lines[start:lastline + 1]) # the first block also contains any lines before the first section
+            start = lastline + 1
+        if start < len(lines): # lines after the last section are kept in the last block
+            if len(blocks) == 0:
+                blocks.append([])
+            blocks[-1].extend(lines[start:])
+        self.blocks = self.create_blocks()
+        self.owned = None
+        self.reset_index()
+        for block in blocks:
+            self.blocks[next(self.block_ids)] = block
+
+    def reset_index(self):
+        """Clears the index of sections to blocks"""
+        self.interface_block = None
+        self.peer_blocks = dict()
+        self.block_keys = dict()
+        self.duplicate_keys = set()
+        self.peer_keys = None
+        self.comment_index = None
+
+    def iter_lines(self, config):
+        """Yields all lines in file order"""
+        return itertools.chain.from_iterable(self.blocks.values())
+
+    def iter_sections(self, config, include_raw=True):
+        """Yields a tuple of section name and section data per section in file order"""
+        for block in self.blocks.values():
+            for section, section_data in config.iter_sections(block, include_raw):
+                yield section, section_data
+
+    def parse(self, config):
+        """Parses all blocks and returns the interface data and the dictionary of peer data"""
+        interface = dict()
+        peers = dict()
+        self.reset_index()
+        for block_id, block in self.blocks.items():
+            self.block_keys[block_id] = []
+            for section, section_data in config.iter_sections(block, include_raw=not config.compact):
+                if section == 'interface':
+                    interface = section_data
+                    self.interface_block = block_id
+                else:
+                    key = section_data.get(config.keyattr)
+                    if key in peers:
+                        self.duplicate_keys.add(key)
+                    peers[key] = section_data
+                    self.peer_blocks[key] = block_id
+                    self.block_keys[block_id].append(key)
+        return interface, peers
+
+    def get_peer_keys(self, config, include_disabled=False):
+        """Returns the (cached) list of the keys of the peers in file order; the data needs to be parsed already"""
+        if self.peer_keys is None:
+            keys = itertools.chain.from_iterable(self.block_keys.get(block_id, []) for block_id in self.blocks)
+            self.peer_keys = split_peer_keys(config, collections.OrderedDict.fromkeys(keys)) # first occurrence of duplicates
+        return self.peer_keys[0 if include_disabled else 1]
+
+    def get_comment_index(self, config):
+        """Returns the index of the leading comments of the peers; the data needs to be parsed already"""
+        if self.comment_index is None:
+            self.comment_index = CommentIndex(config, config._peers)
+        return self.comment_index
+
+    def own_block(self, block_id):
+        """Returns the block with the given id after copying it in case it is shared with other storage objects"""
+        block = self.blocks[block_id]
+        if (self.owned is not None) and (block_id not in self.owned):
+            block = list(block)
+            self.blocks[block_id] = block
+            self.owned.add(block_id)
+        return block
+
+    def get_block_id(self, key):
+        """Returns the id of the block of the section with the given key ("None" for the interface section)"""
+        return self.interface_block if key is None else self.peer_blocks[key]
+
+    def get_section_lines(self, config, key, modify=True):
+        """Returns the block that contains the section with the given key ("None" for the interface section)"""
+        if not modify:
+            return self.blocks[self.get_block_id(key)]
+        return self.own_block(self.get_block_id(key))
+
+    def refresh_block(self, config, block_id):
+        """Reparses the block with the given id and updates the parsed data of its sections"""
+        if (config._interface is None) or (config._peers is None):
+            return # nothing parsed yet
+        self.peer_keys = None
+        old_keys = self.block_keys.pop(block_id, [])
+        for key in old_keys:
+            if self.peer_blocks.get(key) == block_id:
+                del self.peer_blocks[key]
+                section_data = config._peers.pop(key, None)
+                if (self.comment_index is not None) and (section_data is not None):
+                    self.comment_index.remove(key, section_data)
+        if self.interface_block == block_id:
+            self.interface_block = None
+            config._interface = dict()
+        if block_id in self.blocks:
+            self.block_keys[block_id] = []
+            for section, section_data in config.iter_sections(self.blocks[block_id], include_raw=not config.compact):
+                if section == 'interface':
+                    config._interface = section_data
+                    self.interface_block = block_id
+                else:
+                    key = section_data.get(config.keyattr)
+                    if key in self.peer_blocks:
+                        self.duplicate_keys.add(key)
+                    config._peers[key] = section_data
+                    self.peer_blocks[key] = block_id
+                    self.block_keys[block_id].append(key)
+                    if self.comment_index is not None:
+                        self.comment_index.add(key, section_data)
+        for key in self.duplicate_keys.intersection(old_keys + self.block_keys.get(block_id, [])):
+            self.resolve_duplicate(config, key)
+
+    def resolve_duplicate(self, config, key):
+        """Makes the parsed data of a key occurring more than once the one of its last section (like parsing all lines does)"""
+        block_ids = [block_id for block_id in self.blocks if key in self.block_keys.get(block_id, [])]
+        if len(block_ids) <= 1:
+            self.duplicate_keys.discard(key)
+        if (len(block_ids) == 0) or (self.peer_blocks.get(key) == block_ids[-1]):
+            return
+        block_id = block_ids[-1]
+        section_data = [data for section, data in config.iter_sections(self.blocks[block_id], include_raw=not config.compact)
+                        if (section == 'peer') and (data.get(config.keyattr) == key)][-1]
+        if self.comment_index is not None:
+            if key in config._peers:
+                self.comment_index.remove(key, config._peers[key])
+            self.comment_index.add(key, section_data)
+        config._peers[key] = section_data
+        self.peer_blocks[key] = block_id
+
+    def section_changed(self, config, key):
+        """Updates the parsed data after the lines of the section with the given key have been changed in place"""
+        self.refresh_block(config, self.get_block_id(key))
+
+    def add_section(self, config, lines):
+        """Adds the given lines of a new section (including a separating blank line) as new block"""
+        block_id = next(self.block_ids)
+        self.blocks[block_id] = lines
+        if self.owned is not None:
+            self.owned.add(block_id)
+        self.refresh_block(config, block_id)
+
+    def update_sections(self, config, updates):
+        """Replaces the lines of the sections given by a dictionary of key and function returning new lines for the current ones"""
+        for key, func in updates.items():
+            block_id = self.get_block_id(key)
+            block = self.own_block(block_id)
+            section_firstline, section_lastline = config.get_sectioninfo(key)
+            block[section_firstline:(section_lastline + 1)] = func(block[section_firstline:(section_lastline + 1)])
+            self.refresh_block(config, block_id)
+
+    def remove_section(self, config, key):
+        """Removes the peer section with the given key including a blank line directly before it"""
+        block_id = self.get_block_id(key)
+        block = self.own_block(block_id)
+        section_firstline, section_lastline = config.get_sectioninfo(key)
+        # Remove a blank line directly before the peer section
+        if section_firstline > 0:
+            if len(block[section_firstline - 1]) == 0:
+                section_firstline -= 1
+        del block[section_firstline:(section_lastline + 1)]
+        if len(block) == 0:
+            del self.blocks[block_id]
+        self.refresh_block(config, block_id)
+
+    def share(self):
+        """Returns a new storage object sharing the data with this one; "unshare" needs to be called on both before any modification"""
+        other = self.__class__()
+        other.blocks = self.blocks
+        other.block_ids = self.block_ids
+        other.interface_block = self.interface_block
+        other.peer_blocks = self.peer_blocks
+        other.block_keys = self.block_keys
+        other.duplicate_keys = self.duplicate_keys
+        return other
+
+    def unshare(self):
+        """Stops sharing data with other storage objects; blocks are copied only when modified"""
+        self.blocks = collections.OrderedDict(self.blocks)
+        self.owned = set()
+        self.peer_blocks = dict(self.peer_blocks)
+        self.block_keys = dict(self.block_keys)
+        self.duplicate_keys = set(self.duplicate_keys)
+
+
+class SQLiteBlocks(MutableMapping):
+    """Mapping of block ids to blocks (lists of lines) stored in an SQLite table in the order of the block ids
+
+    Blocks handed out for modification are kept in memory until they are written back by "flush".
+    """
+
+    def __init__(self, connection):
+        """Object initialization"""
+        self.connection = connection
+        self.modified = dict() # block id -> block that may have been modified in memory
+        self.connection.execute('CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, lines TEXT NOT NULL)')
+
+    @staticmethod
+    def decode(text):
+        """Returns the list of lines stored as the given text"""
+        return text.split('\n')
+
+    def __getitem__(self, block_id):
+        block = self.modified.get(block_id)
+        if block is not None:
+            return block
+        row = self.connection.execute('SELECT lines FROM blocks WHERE id = ?', (block_id,)).fetchone()
+        if row is None:
+            raise KeyError(block_id)
+        return self.decode(row[0])
+
+    def __setitem__(self, block_id, block):
+        self.modified.pop(block_id, None)
+        self.connection.execute('INSERT OR REPLACE INTO blocks (id, lines) VALUES (?, ?)', (block_id, '\n'.join(block)))
+
+    def __delitem__(self, block_id):
+        self.modified.pop(block_id, None)
+        if self.connection.execute('DELETE FROM blocks WHERE id = ?', (block_id,)).rowcount == 0:
+            raise KeyError(block_id)
+
+    def __contains__(self, block_id):
+        return self.connection.execute('SELECT 1 FROM blocks WHERE id = ?', (block_id,)).fetchone() is not None
+
+    def __iter__(self):
+        for row in self.connection.execute('SELECT id FROM blocks ORDER BY id'):
+            yield row[0]
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM blocks').fetchone()[0]
+
+    def items(self):
+        """Yields tuples of block id and block in order (streamed from the database)"""
+        for block_id, text in self.connection.execute('SELECT id, lines FROM blocks ORDER BY id'):
+            block = self.modified.get(block_id)
+            yield block_id, (self.decode(text) if block is None else block)
+
+    def values(self):
+        """Yields the blocks in order (streamed from the database)"""
+        for block_id, block in self.items():
+            yield block
+
+    def clear(self):
+        """Removes all blocks"""
+        self.modified = dict()
+        self.connection.execute('DELETE FROM blocks')
+
+    def get_modifiable(self, block_id):
+        """Returns the block with the given id for modification in place; call "flush" afterwards"""
+        block = self[block_id]
+        self.modified[block_id] = block
+        return block
+
+    def flush(self, block_id):
+        """Writes the block with the given id back to the database in case it was handed out for modification; empty blocks are removed"""
+        block = self.modified.pop(block_id, None)
+        if block is None:
+            return
+        if len(block) > 0:
+            self[block_id] = block
+        elif block_id in self:
+            del self[block_id]
+
+
+class SQLiteStorage(BlockStorage):
+    """Stores the lines in one SQLite table row per section so that they don't need to be kept in memory
+
+    A modification updates the row of the affected section only. The database defaults to an in-memory one;
+    with a filename, the lines are kept on disk.
+    """
+
+    def __init__(self, database=':memory:'):
+        """Object initialization"""
+        BlockStorage.__init__(self)
+        self.database = database
+        self.connection = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self.blocks = SQLiteBlocks(self.connection)
+        self.block_ids = itertools.count(self.connection.execute('SELECT COALESCE(MAX(id), -1) + 1 FROM blocks').fetchone()[0]) # continue an existing database
+
+    def create_blocks(self):
+        """Returns the (emptied) table of blocks"""
+        self.blocks.clear()
+        return self.blocks
+
+    def set_lines(self, config, lines):
+        """Replaces all lines, splitting them into blocks, within one transaction"""
+        with self.connection:
+            self.connection.execute('BEGIN')
+            BlockStorage.set_lines(self, config, lines)
+
+    def own_block(self, block_id):
+        """Returns the block with the given id for modification in place"""
+        return self.blocks.get_modifiable(block_id)
+
+    def refresh_block(self, config, block_id):
+        """Writes the block with the given id back to the database and updates the parsed data of its sections"""
+        self.blocks.flush(block_id)
+        BlockStorage.refresh_block(self, config, block_id)
+
+    def share(self):
+        """Returns a new storage object with a copy of the database (the database is not shared)"""
+        other = self.__class__()
+        self.connection.backup(other.connection)
+        other.block_ids = itertools.count(next(self.block_ids))
+        other.interface_block = self.interface_block
+        other.peer_blocks = dict(self.peer_blocks)
+        other.block_keys = dict(self.block_keys)
+        other.duplicate_keys = set(self.duplicate_keys)
+        return other
+
+    def unshare(self):
+        """Nothing to do as the database is never shared"""
+        pass
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Generation of the WireGuard configurations of all nodes of a hub-and-spoke or full mesh topology"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import ipaddress
+import os
+
+from . import wgexec
+
+
+class Topology():
+    """A class for generating the WireGuard configurations of a set of nodes"""
+    INTERFACE_ATTRS = ['PrivateKey', 'Address', 'ListenPort', 'DNS', 'MTU']
+
+    def __init__(self, nodes, hub=None, persistent_keepalive=None):
+        """Object initialization; "nodes" is a list of dictionaries with a "name" and WireGuard attributes, "hub" is the name of the hub node ("None" for a full mesh)"""
+        self.nodes = dict()
+        for node in nodes:
+            if node['name'] in self.nodes:
+                raise ValueError('Duplicate node name [{0}]'.format(node['name']))
+            self.nodes[node['name']] = dict(node)
+        if (hub is not None) and (hub not in self.nodes):
+            raise KeyError('The hub node does not exist')
+        self.hub = hub
+        self.persistent_keepalive = persistent_keepalive
+
+    @staticmethod
+    def as_list(value):
+        """Returns the given attribute value (single value, comma-separated string or list) as a list"""
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return value
+        return [item.strip() for item in str(value).split(',')]
+
+    def generate_keys(self):
+        """Generates missing private and public keys of all nodes in one batch each"""
+        # Nodes without any keys get a new key pair
+        names = [name for name, node in self.nodes.items() if node.get('PrivateKey') is None and node.get('PublicKey') is None]
+        keypairs = wgexec.generate_keypairs(len(names))
+        if keypairs is None or len(keypairs) != len(names):
+            raise RuntimeError('Key pairs could not be generated')
+        for name, (wg_private, wg_public) in zip(names, keypairs):
+            self.nodes[name]['PrivateKey'] = wg_private
+            self.nodes[name]['PublicKey'] = wg_public
+        # Nodes with private key only get the public key derived
+        names = [name for name, node in self.nodes.items() if node.get('PublicKey') is None]
+        wg_publics = wgexec.get_publickeys([self.nodes[name]['PrivateKey'] for name in names])
+        if wg_publics is None or len(wg_publics) != len(names):
+            raise RuntimeError('Public keys could not be derived')
+        for name, wg_public in zip(names, wg_publics):
+            self.nodes[name]['PublicKey'] = wg_public
+
+    def get_peer_names(self, name):
+        """Returns the names of the nodes that are peers of the given node"""
+        if self.hub is None: # full mesh
+            return [peername for peername in self.nodes if peername != name]
+        if name == self.hub:
+            return [peername for peername in self.nodes if peername != name]
+        return [self.hub]
+
+    def get_allowed_ips(self, name, peername):
+        """Returns the list of networks that the given node routes to the given peer"""
+        peer = self.nodes[peername]
+        if peer.get('AllowedIPs') is not None:
+            return self.as_list(peer['AllowedIPs'])
+        addresses = [ipaddress.ip_interface(address) for address in self.as_list(peer.get('Address'))]
+        if peername == self.hub: # spokes reach each other via the hub
+            return [str(address.network) for address in addresses]
+        return [str(ipaddress.ip_network(address.ip)) for address in addresses]
+
+    def iter_lines(self, name):
+        """Yields the lines of the WireGuard configuration of the given node"""
+        node = self.nodes[name]
+        if node.get('PrivateKey') is None:
+            raise ValueError('The node [{0}] has no private key'.format(name))
+        yield '# {0}'.format(name)
+        yield '[Interface]'
+        for attr in self.INTERFACE_ATTRS:
+            if node.get(attr) is not None:
+                yield '{0} = {1}'.format(attr, ', '.join(str(item) for item in self.as_list(node[attr])))
+        for peername in self.get_peer_names(name):
+            peer = self.nodes[peername]
+            if peer.get('PublicKey') is None:
+                raise ValueError('The node [{0}] has no public key'.format(peername))
+            yield ''
+            yield '# {0}'.format(peername)
+            yield '[Peer]'
+            yield 'PublicKey = {0}'.format(peer['PublicKey'])
+            allowed_ips = self.get_allowed_ips(name, peername)
+            if len(allowed_ips) > 0:
+                yield 'AllowedIPs = {0}'.format(', '.join(allowed_ips))
+            if peer.get('Endpoint') is not None:
+                yield 'Endpoint = {0}'.format(peer['Endpoint'])
+                if self.persistent_keepalive is not None:
+                    yield 'PersistentKeepalive = {0}'.format(self.persistent_keepalive)
+
+    def write_to_fileobj(self, name, fobj):
+        """Writes the WireGuard configuration of the given node to the given file object"""
+        fobj.writelines(line + '\n' for line in self.iter_lines(name))
+
+    def write_files(self, directory):
+        """Writes the WireGuard configurations of all nodes as "<name>.conf" to the given directory"""
+        for name in self.nodes:
+            filename = os.path.join(directory, name + '.conf')
+            with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640), 'w') as wgfile:
+                self.write_to_fileobj(name, wgfile)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""Validation of the values of WireGuard configuration attributes"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import base64
+import binascii
+import ipaddress
+
+
+def check_key(value):
+    """Checks a base64 encoded 32 byte key"""
+    value = str(value)
+    try:
+        decoded = base64.b64decode(value.encode('ascii'), validate=True)
+    except (binascii.Error, ValueError, UnicodeError):
+        return 'not a valid base64 encoded key'
+    if (len(decoded) != 32) or (len(value) != 44):
+        return 'key needs to have 32 bytes'
+    return None
+
+def check_integer(value, minimum, maximum, allow_off=False):
+    """Checks an integer within the given range"""
+    if allow_off and (value == 'off'):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return 'not an integer'
+    if not (minimum <= value <= maximum):
+        return 'needs to be in range {0}..{1}'.format(minimum, maximum)
+    return None
+
+def check_port(value):
+    """Checks a UDP port"""
+    return check_integer(value, 0, 65535)
+
+def check_keepalive(value):
+    """Checks a persistent keepalive interval"""
+    return check_integer(value, 0, 65535, allow_off=True)
+
+def check_fwmark(value):
+    """Checks a firewall mark"""
+    return check_integer(value, 0, 2**32 - 1, allow_off=True)
+
+def check_network(value):
+    """Checks a network in CIDR notation"""
+    try:
+        ipaddress.ip_network(str(value), strict=False)
+    except ValueError:
+        return 'not a valid network'
+    return None
+
+def check_address(value):
+    """Checks an interface address (optionally with prefix length)"""
+    try:
+        ipaddress.ip_interface(str(value))
+    except ValueError:
+        return 'not a valid address'
+    return None
+
+def check_endpoint(value):
+    """Checks an endpoint given as "host:port" or "[IPv6 address]:port" """
+    value = str(value)
+    if value.startswith('['):
+        host, _, port = value[1:].partition(']')
+        if not port.startswith(':'):
+            return 'port is missing'
+        port = port[1:]
+        if check_address(host) is not None:
+            return 'not a valid IPv6 address'
+    else:
+        host, _, port = value.rpartition(':')
+        if ':' in host:
+            return 'IPv6 addresses need to be enclosed in brackets'
+    if (len(host) == 0) or (' ' in host):
+        return 'not a valid host'
+    if check_integer(port, 1, 65535) is not None:
+        return 'not a valid port'
+    return None
+
+
+VALIDATORS = {
+    'PrivateKey': check_key,
+    'PublicKey': check_key,
+    'PresharedKey': check_key,
+    'AllowedIPs': check_network,
+    'Address': check_address,
+    'ListenPort': check_port,
+    'Endpoint': check_endpoint,
+    'PersistentKeepalive': check_keepalive,
+    'FwMark': check_fwmark,
+}
+
+
+def check_values(attr, values):
+    """Checks the given list of values of the given attribute; returns a list of tuples of invalid value and error message"""
+    validator = VALIDATORS.get(attr)
+    if validator is None:
+        return []
+    result = []
+    for value in values:
+        message = validator(value)
+        if message is not None:
+            result.append((value, message))
+    return result
+
+def check_section(section_data):
+    """Checks all attributes of the given section data; returns a list of tuples of attribute name, invalid value and error message"""
+    result = []
+    for attr, values in section_data.items():
+        if attr.startswith('_'):
+            continue
+        if not isinstance(values, list):
+            values = [values]
+        result.extend((attr, value, message) for value, message in check_values(attr, values))
+    return result
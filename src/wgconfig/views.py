@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Typed read-only views of the parsed data of a section"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import ipaddress
+
+
+class SectionView():
+    """Provides the values of a section as decoded Python objects; values are decoded on first access and cached"""
+
+    def __init__(self, section_data):
+        """Object initialization"""
+        self.section_data = section_data
+        self._decoded = dict()
+
+    def get(self, attr, default=None):
+        """Returns the raw (parsed) value of the given attribute"""
+        return self.section_data.get(attr, default)
+
+    def get_list(self, attr):
+        """Returns the raw (parsed) values of the given attribute as a list"""
+        value = self.section_data.get(attr)
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return value
+        return [value]
+
+    def decode(self, name, func):
+        """Returns the cached result of the given decoding function"""
+        try:
+            return self._decoded[name]
+        except KeyError:
+            value = func()
+            self._decoded[name] = value
+            return value
+
+    @staticmethod
+    def split_endpoint(endpoint):
+        """Splits an endpoint into host and port"""
+        host, _, port = str(endpoint).rpartition(':')
+        if host.startswith('[') and host.endswith(']'):
+            host = host[1:-1]
+        return host, int(port)
+
+    @property
+    def disabled(self):
+        """Whether the section is disabled"""
+        return self.section_data.get('_disabled', False)
+
+    @property
+    def public_key(self):
+        """Public key of the peer"""
+        return self.get('PublicKey')
+
+    @property
+    def allowed_ips(self):
+        """List of networks (ipaddress.ip_network objects) in "AllowedIPs" """
+        return self.decode('allowed_ips', lambda: [ipaddress.ip_network(str(value), strict=False) for value in self.get_list('AllowedIPs')])
+
+    @property
+    def addresses(self):
+        """List of interface addresses (ipaddress.ip_interface objects) in "Address" """
+        return self.decode('addresses', lambda: [ipaddress.ip_interface(str(value)) for value in self.get_list('Address')])
+
+    @property
+    def endpoint(self):
+        """Tuple of host and port of "Endpoint" ("None" if not set)"""
+        return self.decode('endpoint', lambda: None if self.get('Endpoint') is None else self.split_endpoint(self.get('Endpoint')))
+
+    @property
+    def listen_port(self):
+        """Port in "ListenPort" as integer ("None" if not set)"""
+        return self.decode('listen_port', lambda: None if self.get('ListenPort') is None else int(self.get('ListenPort')))
+
+    @property
+    def persistent_keepalive(self):
+        """Interval in "PersistentKeepalive" as integer ("None" if not set or "off")"""
+        return self.decode('persistent_keepalive', lambda: None if self.get('PersistentKeepalive') in (None, 'off') else int(self.get('PersistentKeepalive')))
+
+    def routes(self, address):
+        """Checks whether the given IP address is contained in "AllowedIPs" """
+        if not isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            address = ipaddress.ip_address(str(address))
+        return any(address in network for network in self.allowed_ips if network.version == address.version)
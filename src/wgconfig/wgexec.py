@@ -6,21 +6,123 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import bisect
 import logging
+import os
 import shlex
+import signal
 import subprocess
+import threading
+import time
 
 
 logger = logging.getLogger(__name__);
 
+latency_hook = None # function called with command name, duration in seconds and outcome after each execution
+REAP_TIMEOUT = 1.0 # seconds to wait for the pipes of a killed command to be closed
 
-def execute(command, input=None, suppressoutput=False, suppresserrors=False):
-    """Execute a command"""
+
+class CommandTimeoutError(Exception):
+    """Raised if a command did not finish within its timeout or deadline (the child process has been killed)"""
+
+    def __init__(self, command, timeout, attempts=1):
+        """Object initialization"""
+        super(CommandTimeoutError, self).__init__('Command [{0}] timed out after {1:.3f} seconds ({2} attempt(s))'.format(command, timeout, attempts))
+        self.command = command
+        self.timeout = timeout
+        self.attempts = attempts
+
+
+class LatencyHistogram():
+    """Latency histogram per command; an instance can be set as latency hook"""
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0) # upper bounds in seconds
+
+    def __init__(self, buckets=BUCKETS):
+        """Object initialization"""
+        self.buckets = tuple(sorted(buckets))
+        self.histograms = dict() # command name -> list of counts per bucket (last one for larger values)
+        self.sums = dict() # command name -> total duration in seconds
+        self.outcomes = dict() # command name -> dictionary of outcome and count
+        self._lock = threading.Lock()
+
+    def __call__(self, command, duration, outcome):
+        """Records the duration of an execution of the given command"""
+        with self._lock:
+            counts = self.histograms.setdefault(command, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, duration)] += 1
+            self.sums[command] = self.sums.get(command, 0.0) + duration
+            outcomes = self.outcomes.setdefault(command, dict())
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def get_histogram(self, command):
+        """Returns a list of tuples of bucket upper bound ("None" for the overflow bucket) and count for the given command"""
+        with self._lock:
+            counts = list(self.histograms.get(command, [0] * (len(self.buckets) + 1)))
+        return list(zip(list(self.buckets) + [None], counts))
+
+
+def get_command_name(args):
+    """Returns the name used for the latency metrics of a command (program and subcommand, e.g. "wg show")"""
+    return ' '.join(args[:2])
+
+def report_latency(args, start, outcome):
+    """Passes the duration of an execution to the latency hook (if set)"""
+    hook = latency_hook
+    if hook is None:
+        return
+    try:
+        hook(get_command_name(args), time.monotonic() - start, outcome)
+    except Exception:
+        logger.exception('Latency hook failed')
+
+def kill(nsp):
+    """Kills the given child process including its process group (i.e. descendants that may hold the pipes)"""
+    try:
+        os.killpg(nsp.pid, signal.SIGKILL)
+    except (AttributeError, OSError): # no process groups or already gone
+        nsp.kill()
+
+def execute(command, input=None, suppressoutput=False, suppresserrors=False, timeout=None, deadline=None, retries=0, backoff=0.1):
+    """Execute a command
+
+    "timeout" limits each attempt (seconds), "deadline" all attempts including waiting between them (as returned
+    by time.monotonic()). A command not finished in time is killed with its process group; it is retried up to "retries" times with
+    exponential backoff starting at "backoff" seconds. CommandTimeoutError is raised if no attempt finished in time.
+    """
     args = shlex.split(command)
     stdin = None if input is None else subprocess.PIPE
     input = None if input is None else input.encode('utf-8')
-    nsp = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = nsp.communicate(input=input)
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CommandTimeoutError(command, 0 if timeout is None else timeout, attempt - 1)
+            attempt_timeout = remaining if timeout is None else min(timeout, remaining)
+        start = time.monotonic()
+        nsp = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        try:
+            out, err = nsp.communicate(input=input, timeout=attempt_timeout)
+        except subprocess.TimeoutExpired:
+            kill(nsp)
+            try:
+                nsp.communicate(timeout=REAP_TIMEOUT) # reap the child and close the pipes
+            except subprocess.TimeoutExpired: # pipes still held by a process outside the group
+                for pipe in (nsp.stdin, nsp.stdout, nsp.stderr):
+                    if pipe is not None:
+                        pipe.close()
+                logger.warning('Command [{0}] could not be reaped after being killed'.format(command))
+            report_latency(args, start, 'timeout')
+            logger.warning('Command [{0}] timed out after {1:.3f} seconds (attempt {2})'.format(command, attempt_timeout, attempt))
+            delay = backoff * 2 ** (attempt - 1)
+            if (attempt > retries) or ((deadline is not None) and (time.monotonic() + delay >= deadline)):
+                raise CommandTimeoutError(command, attempt_timeout, attempt)
+            time.sleep(delay)
+            continue
+        report_latency(args, start, 'ok' if nsp.returncode == 0 else 'error')
+        break
     if err is not None:
         err = err.decode('utf8')
         if not suppresserrors and (len(err) > 0):
@@ -31,10 +133,10 @@ def execute(command, input=None, suppressoutput=False, suppresserrors=False):
     nsp.wait()
     return out, err, nsp.returncode
 
-def execute_wgtools(command, input=None):
-    """Execute a command from WireGuard tools"""
+def execute_wgtools(command, input=None, **kwargs):
+    """Execute a command from WireGuard tools; further keyword arguments (e.g. "timeout") are passed to execute()"""
     try:
-        return execute(command, input=input, suppressoutput=True)
+        return execute(command, input=input, suppressoutput=True, **kwargs)
     except FileNotFoundError as e:
         note = 'You need to have WireGuard tools installed for this action to succeed'
         if hasattr(e, 'add_note'):  # Python 3.11+ ?
@@ -67,6 +169,27 @@ def generate_keypair():
     wg_public = get_publickey(wg_private)
     return wg_private, wg_public
 
+def generate_keypairs(count, **kwargs):
+    """Generates the given number of WireGuard key pairs using a single shell invocation (returns list of tuples of private key and public key); further keyword arguments (e.g. "timeout") are passed to execute()"""
+    if count <= 0:
+        return []
+    script = 'for i in $(seq {0}); do k=$(wg genkey) || exit 1; echo "$k"; echo "$k" | wg pubkey || exit 1; done'.format(int(count))
+    out, err, returncode = execute('sh -c ' + shlex.quote(script), suppressoutput=True, **kwargs)
+    if (returncode != 0) or (len(err) > 0):
+        return None
+    keys = out.split()
+    return list(zip(keys[0::2], keys[1::2]))
+
+def get_publickeys(wg_privates, **kwargs):
+    """Gets the public keys belonging to the given WireGuard private keys using a single shell invocation; further keyword arguments (e.g. "timeout") are passed to execute()"""
+    if len(wg_privates) == 0:
+        return []
+    script = 'while read -r k; do echo "$k" | wg pubkey || exit 1; done'
+    out, err, returncode = execute('sh -c ' + shlex.quote(script), input='\n'.join(wg_privates) + '\n', suppressoutput=True, **kwargs)
+    if (returncode != 0) or (len(err) > 0):
+        return None
+    return out.split()
+
 def generate_presharedkey():
     """Generates a WireGuard preshared key"""
     out, err, returncode = execute_wgtools('wg genpsk')
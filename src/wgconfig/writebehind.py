@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Coalescing of file writes: changes are written by a background thread at most once per interval"""
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import atexit
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehind():
+    """Background writer calling the given write function once per interval after changes or after a number of changes"""
+
+    def __init__(self, write, interval=1.0, max_changes=100, lock=None):
+        """Object initialization; "write" is the function writing the file, "lock" an optional function returning a context manager held while writing"""
+        self.write = write
+        self.lock = lock # acquired before the internal lock so that the lock order is the same as for callers holding it
+        self.interval = interval # seconds from the first unwritten change to writing
+        self.max_changes = max_changes # number of changes that trigger writing immediately
+        self.changes = 0 # number of unwritten changes
+        self.writes = 0 # number of writes done
+        self.stopped = False
+        self._cond = threading.Condition(threading.Lock())
+        self._write_lock = threading.Lock() # only one write at a time
+        self._thread = threading.Thread(target=self.run, name='wgconfig-write-behind')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def note_change(self):
+        """Marks that there is a change to be written"""
+        with self._cond:
+            self.changes += 1
+            if (self.changes == 1) or (self.changes >= self.max_changes):
+                self._cond.notify_all()
+
+    def discard_changes(self):
+        """Forgets the unwritten changes (e.g. as they have been written otherwise)"""
+        with self._cond:
+            self.changes = 0
+
+    def run(self):
+        """Waits for changes and writes them (thread function)"""
+        while True:
+            with self._cond:
+                while (self.changes == 0) and not self.stopped:
+                    self._cond.wait()
+                if self.stopped:
+                    return
+                deadline = time.time() + self.interval
+                while (self.changes < self.max_changes) and not self.stopped:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self.stopped:
+                    return # "stop" does the final write
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing changes failed; retrying after next change')
+
+    def flush(self):
+        """Writes unwritten changes immediately"""
+        if self.lock is None:
+            return self.write_changes()
+        with self.lock():
+            return self.write_changes()
+
+    def write_changes(self):
+        """Writes unwritten changes (the external lock is held by the caller)"""
+        with self._write_lock:
+            with self._cond:
+                changes = self.changes
+                self.changes = 0
+            if changes == 0:
+                return
+            try:
+                self.write()
+                self.writes += 1
+            except Exception:
+                with self._cond:
+                    self.changes += changes # keep the changes for the next attempt
+                raise
+
+    def stop(self):
+        """Stops the background thread after writing unwritten changes"""
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        try:
+            atexit.unregister(self.stop)
+        except AttributeError: # Python2
+            pass
+        self.flush()
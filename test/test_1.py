@@ -7,6 +7,8 @@ from __future__ import print_function
 
 import copy
 import filecmp
+import io
+import json
 import os
 import pprint
 import pytest
@@ -36,17 +38,27 @@ def output_data(wc):
     print('PEERS:')
     pprint.pprint(wc.peers)
 
-def get_peer_property_without_rawdata(wc):
-    """Return the peer property of the provided wgconfig object without providing the _rawdata attribute"""
+def get_peer_property_without_hash(wc):
+    """Return the peer property of the provided wgconfig object without providing the _hash and _leading_comment attributes"""
     result = copy.deepcopy(wc.peers)
+    for peer in result.values():
+        del peer['_hash']
+        peer.pop('_leading_comment', None)
+    return result
+
+def get_peer_property_without_rawdata(wc):
+    """Return the peer property of the provided wgconfig object without providing the _rawdata, _hash and _leading_comment attributes"""
+    result = get_peer_property_without_hash(wc)
     for peer in result.values():
         del peer['_rawdata']
     return result
 
 def get_interface_property_without_rawdata(wc):
-    """Return the interface property of the provided wgconfig object without providing the _rawdata attribute"""
+    """Return the interface property of the provided wgconfig object without providing the _rawdata, _hash and _leading_comment attributes"""
     result = copy.deepcopy(wc.interface)
     del result['_rawdata']
+    del result['_hash']
+    result.pop('_leading_comment', None)
     return result
 
 def test_saved_file_is_unchanged(setup_testconfig1):
@@ -202,6 +214,7 @@ def test_get_peer(setup_testconfig1):
                                                              '_index_lastline': 32}}
     peerdata = wc.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', include_details = True)
     del peerdata['_rawdata']
+    del peerdata['_hash']
     assert peerdata == {'AllowedIPs': ['fe80::2/128',
                                        '9999::2/128'],
                         'Endpoint': '192.168.0.2:51820',
@@ -209,7 +222,8 @@ def test_get_peer(setup_testconfig1):
                         'PublicKey': 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=',
                         '_disabled': False,
                         '_index_firstline': 8,
-                        '_index_lastline': 15}
+                        '_index_lastline': 15,
+                        '_leading_comment': '# This is a third comment'}
     peerdata = wc.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', include_details = False)
     assert peerdata == {'AllowedIPs': ['fe80::2/128',
                                        '9999::2/128'],
@@ -795,7 +809,7 @@ def test_disable_peer1(setup_testconfig1):
                                                                            '#! AllowedIPs = fe80::4/128',
                                                                            '#! AllowedIPs = 9999::4/128',
                                                                            '#! PersistentKeepalive = 25']}}
-    assert wc.peers == peers
+    assert get_peer_property_without_hash(wc) == peers
     assert not wc.get_peer_enabled('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
 
 def test_disable_peer2(setup_testconfig1):
@@ -850,7 +864,7 @@ def test_disable_peer2(setup_testconfig1):
                                                                            '#! AllowedIPs = fe80::4/128',
                                                                            '#! AllowedIPs = 9999::4/128',
                                                                            '#! PersistentKeepalive = 25']}}
-    assert wc.peers == peers
+    assert get_peer_property_without_hash(wc) == peers
     assert not wc.get_peer_enabled('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')
 
 def test_disable_twice_peer2(setup_testconfig1):
@@ -908,7 +922,7 @@ def test_disable_twice_peer2(setup_testconfig1):
                                                                            '#! AllowedIPs = fe80::4/128',
                                                                            '#! AllowedIPs = 9999::4/128',
                                                                            '#! PersistentKeepalive = 25']}}
-    assert wc.peers == peers
+    assert get_peer_property_without_hash(wc) == peers
     assert not wc.get_peer_enabled('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')
 
 def test_enable_peer3(setup_testconfig1):
@@ -963,7 +977,7 @@ def test_enable_peer3(setup_testconfig1):
                                                                            'AllowedIPs = fe80::4/128',
                                                                            'AllowedIPs = 9999::4/128',
                                                                            'PersistentKeepalive = 25']}}
-    assert wc.peers == peers
+    assert get_peer_property_without_hash(wc) == peers
     assert wc.get_peer_enabled('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')        
 
 def test_enable_twice_peer3(setup_testconfig1):
@@ -1021,5 +1035,721 @@ def test_enable_twice_peer3(setup_testconfig1):
                                                                            'AllowedIPs = fe80::4/128',
                                                                            'AllowedIPs = 9999::4/128',
                                                                            'PersistentKeepalive = 25']}}
-    assert wc.peers == peers
+    assert get_peer_property_without_hash(wc) == peers
     assert wc.get_peer_enabled('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')        
+
+def test_export_jsonl(setup_testconfig1):
+    wc = setup_testconfig1
+    fobj = io.StringIO()
+    wc.export_jsonl(fobj)
+    records = [json.loads(line) for line in fobj.getvalue().splitlines()]
+    assert len(records) == 4
+    assert records[0] == {'section': 'interface',
+                          'disabled': False,
+                          'leading_comment': ['# This is a first comment'],
+                          'data': {'PrivateKey': '6FYKQKEtGFAb5HSwyj5cQl3wgS1E9d6SqVjdVksOn2s=',
+                                   'ListenPort': 51820,
+                                   'Address': 'fe80::1/64'}}
+    assert records[1]['leading_comment'] == ['# This is a third comment']
+    assert records[3]['disabled']
+    assert records[3]['data']['AllowedIPs'] == ['fe80::4/128', '9999::4/128']
+
+def test_import_jsonl(setup_testconfig1):
+    import wgconfig
+    wc = setup_testconfig1
+    fobj = io.StringIO()
+    wc.export_jsonl(fobj)
+    fobj.seek(0)
+    wc2 = wgconfig.WGConfig()
+    wc2.import_jsonl(fobj)
+    output_data(wc2)
+    assert wc2.get_interface() == wc.get_interface()
+    assert wc2.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+    assert not wc2.get_peer_enabled('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+    assert wc2.lines[:3] == ['# This is a first comment', '[Interface]', 'PrivateKey = 6FYKQKEtGFAb5HSwyj5cQl3wgS1E9d6SqVjdVksOn2s=']
+    assert wc2.lines[-2:] == ['#! AllowedIPs = fe80::4/128, 9999::4/128', '#! PersistentKeepalive = 25']
+
+def test_snapshot(setup_testconfig1):
+    wc = setup_testconfig1
+    snapshot = wc.snapshot()
+    lines = list(wc.lines)
+    wc.del_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+    wc.add_attr(None, 'MTU', 1420)
+    assert snapshot.lines == lines
+    assert 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=' in snapshot.get_peers()
+    assert 'MTU' not in snapshot.get_interface()
+    assert wc.get_interface()['MTU'] == 1420
+    with pytest.raises(TypeError):
+        snapshot.add_attr(None, 'MTU', 1420)
+
+def test_threadsafe_concurrent_access():
+    import threading
+    import wgconfig
+    wc = wgconfig.WGConfig(file=TESTFILE1, threadsafe=True)
+    wc.read_file()
+    errors = []
+    def add_peers(offset):
+        try:
+            for i in range(offset, offset + 50):
+                key = 'peer{0}'.format(i)
+                wc.add_peer(key)
+                wc.add_attr(key, 'AllowedIPs', '10.0.{0}.{1}/32'.format(i // 256, i % 256))
+        except Exception as e:
+            errors.append(e)
+    def read_peers():
+        try:
+            for i in range(200):
+                for key, data in wc.get_peers(keys_only=False).items():
+                    assert data['PublicKey'] == key
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=add_peers, args=(i * 50,)) for i in range(4)]
+    threads.extend(threading.Thread(target=read_peers) for i in range(4))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(wc.get_peers()) == 2 + 200
+    assert wc.get_peer('peer123')['AllowedIPs'] == '10.0.0.123/32'
+
+def test_rwlock():
+    import threading
+    from wgconfig.rwlock import ReadWriteLock
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    acquired = []
+    other_reader = threading.Thread(target=lambda: (lock.acquire_read(), acquired.append('read'), lock.release_read()))
+    other_reader.start()
+    other_reader.join(5)
+    assert acquired == ['read'] # concurrent readers
+    writer = threading.Thread(target=lambda: (lock.acquire_write(), acquired.append('write'), lock.release_write()))
+    writer.start()
+    writer.join(0.2)
+    assert acquired == ['read'] # writer waits for reader
+    with pytest.raises(RuntimeError):
+        lock.acquire_write() # no upgrade
+    lock.release_read()
+    writer.join(5)
+    assert acquired == ['read', 'write']
+    with lock.write_locked():
+        with lock.read_locked(): # the writer may read
+            pass
+
+def test_write_file_check_unchanged(setup_testconfig1):
+    import shutil
+    import wgconfig
+    shutil.copyfile(TESTFILE1, TESTFILE1_SAVED)
+    wc = wgconfig.WGConfig(file=TESTFILE1_SAVED)
+    wc.read_file()
+    wc_other = wgconfig.WGConfig(file=TESTFILE1_SAVED)
+    wc_other.read_file()
+    wc_other.add_attr(None, 'MTU', 1420)
+    wc_other.write_file(check_unchanged=True)
+    wc.add_attr(None, 'ListenPort', 51821)
+    with pytest.raises(wgconfig.ConcurrentModificationError):
+        wc.write_file(check_unchanged=True)
+    wc_other.add_attr(None, 'DNS', '192.0.2.53')
+    wc_other.write_file(check_unchanged=True) # own writes do not count as changes
+
+def test_modify(setup_testconfig1):
+    import shutil
+    import wgconfig
+    shutil.copyfile(TESTFILE1, TESTFILE1_SAVED)
+    wc = wgconfig.WGConfig(file=TESTFILE1_SAVED)
+    calls = []
+    def change(config):
+        calls.append(1)
+        if len(calls) == 1: # simulate a concurrent change by another process
+            wc_other = wgconfig.WGConfig(file=TESTFILE1_SAVED)
+            wc_other.read_file()
+            wc_other.add_peer('OtherPeer')
+            wc_other.write_file()
+        config.add_attr(None, 'MTU', 1420)
+    wc.modify(change)
+    assert len(calls) == 2
+    wc_check = wgconfig.WGConfig(file=TESTFILE1_SAVED)
+    wc_check.read_file()
+    assert wc_check.get_interface()['MTU'] == 1420
+    assert 'OtherPeer' in wc_check.get_peers()
+
+def test_section_hash(setup_testconfig1):
+    import wgconfig
+    wc = setup_testconfig1
+    wc2 = wgconfig.WGConfig(file=TESTFILE1)
+    wc2.read_file()
+    wc2.del_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'PersistentKeepalive')
+    wc2.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'PersistentKeepalive', 15)
+    wc2.del_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'Endpoint', remove_leading_comments=False)
+    wc2.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'Endpoint', '192.168.0.3:51820', '# Comments do not change the hash')
+    assert wc2.interface['_hash'] == wc.interface['_hash']
+    assert wc2.peers['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']['_hash'] != wc.peers['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']['_hash']
+    assert wc2.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']['_hash'] == wc.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']['_hash']
+
+def test_diff(setup_testconfig1):
+    import wgconfig
+    wc = setup_testconfig1
+    wc2 = wgconfig.WGConfig(file=TESTFILE1)
+    wc2.read_file()
+    assert wgconfig.diff(wc, wc2) == {'interface': {}, 'added': [], 'removed': [], 'modified': {}}
+    wc2.add_attr(None, 'MTU', 1420)
+    wc2.del_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+    wc2.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    wc2.del_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '9999::3/128')
+    wc2.enable_peer('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+    assert wgconfig.diff(wc, wc2) == {
+        'interface': {'MTU': (None, 1420)},
+        'added': ['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM='],
+        'removed': ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA='],
+        'modified': {'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=': {'AllowedIPs': (['fe80::3/128', '9999::3/128'], 'fe80::3/128')},
+                     'ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=': {'_disabled': (True, False)}}}
+
+def test_merge(setup_testconfig1):
+    import wgconfig
+    base = setup_testconfig1
+    ours = wgconfig.WGConfig(file=TESTFILE1)
+    ours.read_file()
+    theirs = wgconfig.WGConfig(file=TESTFILE1)
+    theirs.read_file()
+    # Changes on our side
+    ours.del_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'Endpoint')
+    ours.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'Endpoint', '192.168.1.2:51820', '# Our new endpoint')
+    ours.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.0.0.3/32')
+    # Changes on their side
+    theirs.del_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'PersistentKeepalive')
+    theirs.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'PersistentKeepalive', 15)
+    theirs.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.0.1.3/32')
+    theirs.enable_peer('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+    theirs.add_attr(None, 'MTU', 1420)
+    theirs.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', '# Their new peer')
+    result, conflicts = wgconfig.merge(base, ours, theirs)
+    output_data(result)
+    assert conflicts == [{'key': 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'attr': 'AllowedIPs',
+                          'base': ['fe80::3/128', '9999::3/128'],
+                          'ours': ['fe80::3/128', '9999::3/128', '10.0.0.3/32'],
+                          'theirs': ['fe80::3/128', '9999::3/128', '10.0.1.3/32']}]
+    assert result.get_interface()['MTU'] == 1420
+    assert result.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=') == {'AllowedIPs': ['fe80::2/128', '9999::2/128'],
+                                                                               'Endpoint': '192.168.1.2:51820',
+                                                                               'PersistentKeepalive': 15,
+                                                                               'PublicKey': 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA='}
+    assert result.get_peer('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')['AllowedIPs'] == ['fe80::3/128', '9999::3/128', '10.0.0.3/32']
+    assert result.get_peer_enabled('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+    assert '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=' in result.get_peers()
+    assert '# Our new endpoint' in result.lines
+    assert '# Their new peer' in result.lines
+    assert '# This is a forth comment' in result.lines
+
+def test_merge_removed_peer(setup_testconfig1):
+    import wgconfig
+    base = setup_testconfig1
+    ours = wgconfig.WGConfig(file=TESTFILE1)
+    ours.read_file()
+    theirs = wgconfig.WGConfig(file=TESTFILE1)
+    theirs.read_file()
+    theirs.del_peer('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')
+    theirs.del_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+    ours.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'AllowedIPs', '10.0.0.2/32')
+    result, conflicts = wgconfig.merge(base, ours, theirs)
+    assert [conflict['key'] for conflict in conflicts] == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']
+    assert sorted(result.get_peers(include_disabled=True)) == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=']
+    result_from_theirs, conflicts = wgconfig.merge(base, theirs, base)
+    assert result_from_theirs.lines == theirs.lines
+
+def apply_changes(wc):
+    """Apply a sequence of changes covering all kinds of modifications"""
+    wc.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', '# Newly added peer')
+    wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'AllowedIPs', '10.0.0.5/32', '# Added attribute')
+    wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'AllowedIPs', '10.0.0.6/32')
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.0.0.3/32', append_as_line=True)
+    wc.del_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '9999::3/128')
+    wc.del_attr(None, 'ListenPort')
+    wc.add_attr(None, 'MTU', 1420, '# Added to interface')
+    wc.disable_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+    wc.enable_peer('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+    wc.del_peer('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')
+
+def test_block_storage(setup_testconfig1):
+    import wgconfig
+    wc = setup_testconfig1
+    wc_blocks = wgconfig.WGConfig(file=TESTFILE1, storage=wgconfig.BlockStorage())
+    wc_blocks.read_file()
+    assert wc_blocks.lines == wc.lines
+    assert len(wc_blocks.storage.blocks) == 4
+    assert wc_blocks.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+    assert wc_blocks.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']['_index_firstline'] == 1 # relative to block
+    apply_changes(wc)
+    apply_changes(wc_blocks)
+    output_data(wc_blocks)
+    assert wc_blocks.lines == wc.lines
+    assert wc_blocks.get_interface() == wc.get_interface()
+    assert wc_blocks.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+    wc_blocks.write_file(TESTFILE1_SAVED)
+    wc.filename = TESTFILE1_SAVED
+    wc.read_file()
+    assert wc.lines == wc_blocks.lines
+
+def test_block_storage_snapshot(setup_testconfig1):
+    import wgconfig
+    wc = wgconfig.WGConfig(file=TESTFILE1, storage=wgconfig.BlockStorage())
+    wc.read_file()
+    lines = wc.lines
+    snapshot = wc.snapshot()
+    apply_changes(wc)
+    assert snapshot.lines == lines
+    assert snapshot.get_peer_enabled('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+    assert 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=' in snapshot.get_peers()
+    assert not wc.get_peer_enabled('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+
+def test_sqlite_storage(setup_testconfig1, tmp_path):
+    import wgconfig
+    wc = setup_testconfig1
+    database = str(tmp_path / 'wg.db')
+    wc_sqlite = wgconfig.WGConfig(file=TESTFILE1, storage=wgconfig.SQLiteStorage(database))
+    wc_sqlite.read_file()
+    assert wc_sqlite.lines == wc.lines
+    assert wc_sqlite.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+    apply_changes(wc)
+    apply_changes(wc_sqlite)
+    output_data(wc_sqlite)
+    assert wc_sqlite.lines == wc.lines
+    assert wc_sqlite.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+    snapshot = wc_sqlite.snapshot()
+    wc_sqlite.del_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    assert snapshot.lines == wc.lines
+    # The database can be used again without reading the file
+    lines = wc_sqlite.lines
+    wc_sqlite.storage.connection.close()
+    wc_reopened = wgconfig.WGConfig(storage=wgconfig.SQLiteStorage(database))
+    assert wc_reopened.lines == lines
+    wc_reopened.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    assert wc_reopened.get_peers()[-1] == '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM='
+
+def test_validate(setup_testconfig1, monkeypatch):
+    import wgconfig
+    wc = setup_testconfig1
+    assert wc.validate() == []
+    wc.add_attr(None, 'ListenPort', 70000, append_as_line=True)
+    wc.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'AllowedIPs', '10.0.0.300/32')
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '9999::2/128')
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'PresharedKey', 'tooshort')
+    wc.add_attr('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=', 'Endpoint', 'fe80::4:51820') # disabled but still checked
+    wc.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'PersistentKeepalive', 'off')
+    wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'Endpoint', '[fe80::5]:51820')
+    problems = wc.validate()
+    pprint.pprint(problems)
+    assert len(problems) == 5
+    assert set((problem['key'], problem['attr'], problem['value']) for problem in problems) == set([
+        (None, 'ListenPort', 70000),
+        ('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'AllowedIPs', '10.0.0.300/32'),
+        ('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '9999::2/128'),
+        ('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'PresharedKey', 'tooshort'),
+        ('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=', 'Endpoint', 'fe80::4:51820')])
+    # Unchanged sections are not checked again
+    checked = []
+    check_section = wgconfig.validation.check_section
+    monkeypatch.setattr(wgconfig.validation, 'check_section', lambda section_data: checked.append(section_data) or check_section(section_data))
+    assert wc.validate() == problems
+    assert checked == []
+    wc.del_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'PresharedKey')
+    assert len(wc.validate()) == len(problems) - 1
+    assert [section_data['PublicKey'] for section_data in checked] == ['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+
+def test_validate_on_mutate():
+    import wgconfig
+    wc = wgconfig.WGConfig(validate_on_mutate=True)
+    wc.add_attr(None, 'ListenPort', 51820)
+    with pytest.raises(ValueError):
+        wc.add_attr(None, 'PrivateKey', 'invalid')
+    with pytest.raises(ValueError):
+        wc.add_peer('invalid')
+    wc.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    with pytest.raises(ValueError):
+        wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'PersistentKeepalive', '0x1f')
+    wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'PersistentKeepalive', '025')
+    with pytest.raises(ValueError):
+        wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'AllowedIPs', '10.0.0.0/8, 10.0.0.256/32')
+    wc.add_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'AllowedIPs', '10.0.0.0/8, fd00::/64')
+    assert wc.get_interface() == {'ListenPort': 51820}
+    assert wc.validate() == []
+
+def test_peer_view(setup_testconfig1):
+    import ipaddress
+    wc = setup_testconfig1
+    view = wc.peer_view('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+    assert view.allowed_ips == [ipaddress.ip_network('fe80::2/128'), ipaddress.ip_network('9999::2/128')]
+    assert view.endpoint == ('192.168.0.2', 51820)
+    assert view.persistent_keepalive == 25
+    assert view.routes('9999::2')
+    assert not view.routes('9999::3')
+    assert not view.routes('192.168.0.2')
+    assert view.allowed_ips is view.allowed_ips # decoded only once
+    assert wc.interface_view().addresses == [ipaddress.ip_interface('fe80::1/64')]
+    assert wc.interface_view().listen_port == 51820
+    # Views of unchanged sections are kept, views of changed sections are renewed
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'Endpoint', '[fe80::3]:51821', append_as_line=True)
+    wc.del_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'Endpoint', '192.168.0.3:51820')
+    assert wc.peer_view('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=') is view
+    assert wc.peer_view('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=').endpoint == ('fe80::3', 51821)
+    wc.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'AllowedIPs', '10.0.0.2/32')
+    assert wc.peer_view('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=').routes('10.0.0.2')
+    assert not view.routes('10.0.0.2')
+
+def test_compact(setup_testconfig1):
+    import wgconfig
+    wc = setup_testconfig1
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc_compact = wgconfig.WGConfig(file=TESTFILE1, storage=storage, compact=True)
+        wc_compact.read_file()
+        assert '_rawdata' not in wc_compact.interface
+        assert all('_rawdata' not in peer for peer in wc_compact.peers.values())
+        assert wc_compact.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+        assert wc_compact.get_peer_enabled('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+        assert not wc_compact.get_peer_enabled('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+        assert wc_compact.get_rawdata('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=') == wc.peers['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']['_rawdata']
+        wc_compact.disable_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+        assert not wc_compact.get_peer_enabled('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')
+
+def test_interning(setup_testconfig1):
+    wc = setup_testconfig1
+    peers = list(wc.peers.values())
+    attrs = [[attr for attr in peer if attr == 'AllowedIPs'][0] for peer in peers]
+    assert all(attr is attrs[0] for attr in attrs)
+    assert peers[0]['PersistentKeepalive'] is peers[1]['PersistentKeepalive']
+
+def test_get_peers_paginated(setup_testconfig1):
+    import wgconfig
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage)
+        wc.read_file()
+        keys = wc.get_peers(include_disabled=True)
+        assert keys == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=']
+        assert wc.get_peers(include_disabled=True, offset=1, limit=1) == keys[1:2]
+        assert wc.get_peers(offset=1) == keys[1:2]
+        assert wc.get_peers(limit=0) == []
+        assert wc.get_peers(keys_only=False, fields=['AllowedIPs', '_disabled'], limit=1) == {keys[0]: {'AllowedIPs': wc.peers[keys[0]]['AllowedIPs'], '_disabled': False}}
+        assert wc.get_peers(predicate=lambda data: 'Endpoint' in data, include_disabled=True, offset=1) == keys[1:]
+        # Cached key lists are updated on changes
+        wc.disable_peer(keys[0])
+        assert wc.get_peers() == keys[1:2]
+        wc.del_peer(keys[1])
+        assert wc.get_peers(include_disabled=True) == [keys[0], keys[2]]
+        wc.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        assert wc.get_peers(offset=0, limit=5) == ['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+
+def test_write_behind(setup_testconfig1):
+    import shutil
+    import time
+    import wgconfig
+    shutil.copy(TESTFILE1, TESTFILE1_SAVED)
+    keys = ['{0:043d}='.format(i) for i in range(10)]
+    with wgconfig.WGConfig(TESTFILE1_SAVED, write_behind=60, write_behind_changes=10) as wc:
+        wc.read_file()
+        for key in keys[:9]:
+            wc.add_peer(key)
+            wc.write_file()
+        assert wc._write_behind.writes == 0 # coalesced
+        assert filecmp.cmp(TESTFILE1, TESTFILE1_SAVED, shallow=False)
+        wc.flush()
+        assert wc._write_behind.writes == 1
+        assert filecmp.cmp(TESTFILE1, TESTFILE1_SAVED, shallow=False) == False
+        for key in keys[:5]:
+            wc.del_peer(key)
+            wc.add_peer(key)
+        for i in range(50): # written after the number of changes
+            if wc._write_behind.writes == 2:
+                break
+            time.sleep(0.1)
+        assert wc._write_behind.writes == 2
+        wc.del_peer(keys[0])
+    wc_read = wgconfig.WGConfig(TESTFILE1_SAVED)
+    wc_read.read_file()
+    assert wc_read.get_peers() == wc.get_peers() # written on context exit
+    assert keys[0] not in wc_read.get_peers()
+    with wgconfig.WGConfig(TESTFILE1_SAVED, write_behind=0.1) as wc:
+        wc.read_file()
+        wc.add_peer(keys[0])
+        for i in range(50): # written after the interval
+            if wc._write_behind.writes == 1:
+                break
+            time.sleep(0.1)
+        assert wc._write_behind.writes == 1
+
+def test_set_attr(setup_testconfig1):
+    import wgconfig
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage)
+        wc.read_file()
+        lines = list(wc.lines)
+        wc.set_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'Endpoint', '192.0.2.2:51821')
+        assert wc.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')['Endpoint'] == '192.0.2.2:51821'
+        changed = [(old, new) for old, new in zip(lines, wc.lines) if old != new]
+        assert len(changed) == 1 and len(lines) == len(wc.lines)
+        assert changed[0][1].startswith('Endpoint = 192.0.2.2:51821')
+        wc.set_attr(None, 'ListenPort', 51821)
+        assert wc.get_interface()['ListenPort'] == 51821
+        with pytest.raises(KeyError):
+            wc.set_attr('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', 'Endpoint', '192.0.2.2:51821')
+
+def test_update_peers(setup_testconfig1):
+    import wgconfig
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage)
+        wc.read_file()
+        wc.update_peers({
+            'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=': {'Endpoint': '192.0.2.2:51821', 'PersistentKeepalive': None},
+            'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=': {'AllowedIPs': ['10.0.0.3/32', '10.0.0.4/32'], 'PresharedKey': 'ezBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXc='},
+            'ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=': {'Endpoint': '192.0.2.4:51820'},
+        })
+        peers = wc.get_peers(keys_only=False, include_disabled=True)
+        assert peers['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']['Endpoint'] == '192.0.2.2:51821'
+        assert 'PersistentKeepalive' not in peers['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']
+        assert peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']['AllowedIPs'] == ['10.0.0.3/32', '10.0.0.4/32']
+        assert peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']['PresharedKey'] == 'ezBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXc='
+        assert peers['ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=']['Endpoint'] == '192.0.2.4:51820'
+        assert not wc.get_peer_enabled('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')
+        assert '#! Endpoint = 192.0.2.4:51820' in wc.lines
+
+def test_compact_allowed_ips(setup_testconfig1):
+    wc = setup_testconfig1
+    key = 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA='
+    for i in range(4):
+        wc.add_attr(key, 'AllowedIPs', '10.0.0.{0}/32'.format(i), append_as_line=True)
+    wc.add_attr(key, 'AllowedIPs', '9999::3/128')
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.1.0.0/16')
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.1.2.0/24')
+    lines = list(wc.lines)
+    report = wc.compact_allowed_ips(dry_run=True)
+    assert report == {key: (7, 3), 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=': (4, 3)}
+    assert wc.lines == lines
+    assert wc.snapshot().compact_allowed_ips(dry_run=True) == report
+    with pytest.raises(TypeError):
+        wc.snapshot().compact_allowed_ips()
+    assert wc.compact_allowed_ips(key) == {key: (7, 3)}
+    assert wc.get_peer(key)['AllowedIPs'] == ['10.0.0.0/30', '9999::2/127', 'fe80::2/128']
+    assert len([line for line in wc.lines if line.startswith('AllowedIPs')]) == len([line for line in lines if line.startswith('AllowedIPs')]) - 4
+    assert wc.compact_allowed_ips() == {'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=': (4, 3)}
+    assert wc.compact_allowed_ips() == {}
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.2.0.0/24')
+    wc.add_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'AllowedIPs', '10.2.1.0/24')
+    wc.add_attr(key, 'AllowedIPs', 'not-a-network')
+    assert wc.compact_allowed_ips() == {key: None, 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=': (5, 4)}
+    assert 'not-a-network' in wc.get_peer(key)['AllowedIPs']
+    assert '10.2.0.0/23' in wc.get_peer('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')['AllowedIPs']
+
+def test_find_peers_by_comment(setup_testconfig1):
+    import wgconfig
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage)
+        wc.read_file()
+        assert wc.interface['_leading_comment'] == '# This is a first comment'
+        assert '_leading_comment' not in wc.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+        assert wc.find_peers_by_comment('third') == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']
+        assert wc.find_peers_by_comment('comment') == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=']
+        wc.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', '# alice-laptop ticket-4411')
+        wc.add_peer('0000000000000000000000000000000000000000000=', '# Alice-Phone')
+        assert wc.peers['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']['_leading_comment'] == '# alice-laptop ticket-4411'
+        assert wc.find_peers_by_comment('alice') == ['0000000000000000000000000000000000000000000=', '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+        assert wc.find_peers_by_comment('Alice laptop') == ['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+        assert wc.find_peers_by_comment('4411') == ['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+        assert wc.find_peers_by_comment('bob') == []
+        wc.disable_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        assert wc.find_peers_by_comment('laptop') == ['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+        wc.del_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        assert wc.find_peers_by_comment('alice') == ['0000000000000000000000000000000000000000000=']
+
+def test_to_wg_setconf(setup_testconfig1):
+    import wgconfig
+    wc = setup_testconfig1
+    wc.add_attr(None, 'PostUp', 'iptables -A FORWARD -i %i -j ACCEPT')
+    wc.add_attr(None, 'DNS', '10.0.0.1', append_as_line=True)
+    wc.add_attr(None, 'Table', 'off')
+    fobj = io.StringIO()
+    wc.to_wg_setconf(fobj)
+    assert fobj.getvalue() == wc.to_wg_setconf()
+    assert wc.to_wg_setconf() == '''[Interface]
+PrivateKey = 6FYKQKEtGFAb5HSwyj5cQl3wgS1E9d6SqVjdVksOn2s=
+ListenPort = 51820
+
+[Peer]
+Endpoint = 192.168.0.2:51820
+PublicKey = XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=
+AllowedIPs = fe80::2/128, 9999::2/128
+PersistentKeepalive = 25
+
+[Peer]
+Endpoint = 192.168.0.3:51820
+PublicKey = eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=
+AllowedIPs = fe80::3/128, 9999::3/128
+PersistentKeepalive = 25
+'''
+    wc = wgconfig.WGConfig(file=TESTFILE1, threadsafe=True)
+    wc.read_file()
+    lines = wc.iter_wg_setconf_lines()
+    next(lines)
+    assert len(wc._lock._readers) == 0 # not held while iterating, so an abandoned iterator doesn't block writers
+    wc.set_attr('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=', 'PersistentKeepalive', 30)
+    assert list(lines)[-1] == 'PersistentKeepalive = 25'
+    assert len(wc._lock._readers) == 0
+
+def test_compact_file(tmp_path):
+    import datetime
+    import shutil
+    import wgconfig
+    filename = str(tmp_path / 'wg0.conf')
+    archive = str(tmp_path / 'wg0.archive')
+    shutil.copyfile(TESTFILE1, filename)
+    wc = wgconfig.WGConfig(file=filename)
+    wc.read_file()
+    wc.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=', '# disabled 2024-03-01')
+    wc.disable_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    wc.add_peer('0000000000000000000000000000000000000000000=', '# disabled 2023-12-24, invalid date 2023-13-01')
+    wc.disable_peer('0000000000000000000000000000000000000000000=')
+    wc.lines = wc.lines[:8] + ['', ''] + wc.lines[8:] + ['', '']
+    wc.invalidate_data()
+    assert wc.compact_file(archive, disabled_before=datetime.date(2024, 1, 1), write=False) == ['0000000000000000000000000000000000000000000=']
+    assert '' not in [line for i, line in enumerate(wc.lines) if (i == 0) or (wc.lines[i - 1] == '')]
+    assert wc.lines[-1] != ''
+    assert len(wc.get_peers(include_disabled=True)) == 4
+    assert wc.compact_file(archive) == ['ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=', '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+    assert wc.get_peers(include_disabled=True) == wc.get_peers()
+    assert wc.compact_file(archive) == []
+    wc2 = wgconfig.WGConfig(file=filename)
+    wc2.read_file()
+    assert wc2.lines == wc.lines
+    assert wc2.get_peers() == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+    archived = wgconfig.WGConfig(file=archive)
+    archived.read_file()
+    assert archived.get_peers(include_disabled=True) == ['0000000000000000000000000000000000000000000=', 'ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=', '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']
+    assert archived.peers['801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=']['_leading_comment'] == '# disabled 2024-03-01'
+    assert os.stat(archive).st_mode & 0o037 == 0 # contains keys, so not readable for others (umask may remove more bits)
+
+def test_copy():
+    import copy
+    import wgconfig
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage, threadsafe=True)
+        wc.read_file()
+        lines = list(wc.lines)
+        clone = wc.copy()
+        assert clone.lines == lines
+        assert clone.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE='] is wc.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+        clone.add_attr('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'AllowedIPs', '10.0.0.2/32')
+        clone.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        assert wc.lines == lines
+        assert '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=' not in wc.get_peers()
+        assert '10.0.0.2/32' not in wc.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')['AllowedIPs']
+        assert '10.0.0.2/32' in clone.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')['AllowedIPs']
+        if storage is not None: # unchanged blocks and their parsed data are still shared
+            assert clone.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE='] is wc.peers['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+            block_id = wc.storage.peer_blocks['eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+            assert clone.storage.blocks[block_id] is wc.storage.blocks[block_id]
+        wc.del_peer('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')
+        assert 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=' in clone.get_peers()
+        clone2 = copy.copy(clone)
+        clone2.disable_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        assert clone.get_peer_enabled('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        assert not clone2.get_peer_enabled('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        clone2.add_peer('0000000000000000000000000000000000000000000=') # the clone has its own lock
+
+def test_write_behind_modify(setup_testconfig1):
+    import shutil
+    import threading
+    import wgconfig
+    shutil.copy(TESTFILE1, TESTFILE1_SAVED)
+    with wgconfig.WGConfig(TESTFILE1_SAVED, write_behind=0.01, write_behind_changes=1) as wc:
+        wc.read_file()
+        def add_peers():
+            for i in range(100):
+                wc.add_peer('{0:043d}='.format(i))
+        thread = threading.Thread(target=add_peers)
+        thread.daemon = True
+        thread.start()
+        for i in range(20): # flushes under the write lock while the background writer flushes
+            wc.modify(lambda wc: wc.add_attr(None, 'ListenPort', 51821 + i))
+        thread.join(10)
+        assert not thread.is_alive()
+        wc.modify(lambda wc: wc.add_attr(None, 'MTU', 1420), retries=0) # only the final attempt holding the file lock
+        wc_read = wgconfig.WGConfig(TESTFILE1_SAVED)
+        wc_read.read_file()
+        assert wc_read.get_interface()['MTU'] == 1420 # not left to the background writer
+
+def test_section_hash_stable():
+    import subprocess
+    import sys
+    import wgconfig
+    wc = wgconfig.WGConfig(file=TESTFILE1)
+    wc.read_file()
+    script = 'import wgconfig; wc = wgconfig.WGConfig(file={0!r}); wc.read_file(); print(wc.interface["_hash"])'.format(TESTFILE1)
+    env = dict(os.environ, PYTHONHASHSEED='1234')
+    output = subprocess.check_output([sys.executable, '-c', script], env=env, universal_newlines=True)
+    assert output.strip() == wc.interface['_hash']
+
+def test_del_duplicate_peer():
+    import wgconfig
+    key = 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA='
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage)
+        wc.read_file()
+        wc.add_section_lines(['# duplicate', '[Peer]', 'PublicKey = ' + key, 'AllowedIPs = 10.0.0.9/32'])
+        assert wc.get_peer(key)['AllowedIPs'] == '10.0.0.9/32' # the last section counts
+        assert wc.validate() != []
+        wc.find_peers_by_comment('duplicate')
+        wc.del_peer(key)
+        assert wc.get_peers() == ['XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=', 'eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=']
+        assert wc.get_peer(key)['AllowedIPs'] == ['fe80::2/128', '9999::2/128']
+        assert wc.find_peers_by_comment('duplicate') == []
+        assert wc.find_peers_by_comment('third') == [key]
+        assert wc.validate() == []
+        wc.del_peer(key)
+        assert key not in wc.get_peers()
+        assert wc.lines == [line for line in wc.lines if key not in line]
+
+def test_handle_leading_comment():
+    import wgconfig
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(storage=storage)
+        wc.initialize_file('# Leading comment for interface section')
+        assert wc.lines == ['# Leading comment for interface section', '[Interface]']
+        wc.handle_leading_comment('# Trailing comment')
+        assert wc.lines == ['# Leading comment for interface section', '[Interface]', '# Trailing comment']
+        assert wc.interface['_leading_comment'] == '# Leading comment for interface section'
+
+def test_validate_shared_duplicates():
+    import wgconfig
+    key = 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA='
+    for storage in [None, wgconfig.BlockStorage()]:
+        wc = wgconfig.WGConfig(file=TESTFILE1, storage=storage)
+        wc.read_file()
+        wc.add_section_lines(['[Peer]', 'PublicKey = ' + key])
+        problems = wc.validate()
+        assert 'peer occurs more than once' in [problem['message'] for problem in problems]
+        assert wc.snapshot().validate() == problems
+        assert wc.copy().validate() == problems
+
+def test_write_behind_concurrent_change(tmp_path):
+    import wgconfig
+    filename = str(tmp_path / 'wg0.conf')
+    with wgconfig.WGConfig(filename, write_behind=60) as wc:
+        wc.initialize_file('# new file')
+        wc.write_file()
+        wc.flush()
+        assert os.path.exists(filename) # initialize_file counts as change
+        wc.read_from_fileobj(io.StringIO(open(TESTFILE1).read()))
+        wc.flush()
+        assert open(filename).read() == open(TESTFILE1).read()
+        wc.modify(lambda wc: wc.add_attr(None, 'MTU', 1420))
+        assert wc._write_behind.changes == 0 # written by modify
+        other = wgconfig.WGConfig(filename)
+        other.read_file()
+        other.add_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+        other.write_file()
+        wc.flush()
+        assert '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=' in open(filename).read()
+        wc.add_attr(None, 'ListenPort', 51821, append_as_line=True)
+        with pytest.raises(wgconfig.ConcurrentModificationError): # not overwriting the change of the other writer
+            wc.flush()
+        assert '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=' in open(filename).read()
+        wc.read_file()
+        assert wc._write_behind.changes == 0
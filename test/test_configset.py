@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import base64
+import pytest
+
+
+KEYS = [base64.b64encode(bytes([i]) * 32).decode() for i in range(30)]
+
+
+@pytest.fixture
+def configset(tmp_path):
+    from wgconfig import WGConfig, WGConfigSet
+    for i in range(3):
+        wc = WGConfig(str(tmp_path / 'wg{0}.conf'.format(i)))
+        for key in KEYS[i * 10:(i + 1) * 10]:
+            wc.add_peer(key)
+        wc.write_file()
+    (tmp_path / 'README').write_text('not a configuration')
+    return WGConfigSet(directory=str(tmp_path))
+
+def test_loading(configset, tmp_path):
+    from wgconfig import WGConfig, WGConfigSet
+    assert list(configset.configs) == ['wg0', 'wg1', 'wg2']
+    assert configset.get_interface_name(KEYS[15]) == 'wg1'
+    name, section_data = configset.get_section(KEYS[15])
+    assert (name, section_data['PublicKey']) == ('wg1', KEYS[15])
+    assert sorted(configset.get_peers()) == sorted(KEYS)
+    wc = WGConfig(str(tmp_path / 'wg3.conf'))
+    wc.add_peer(KEYS[0])
+    wc.write_file()
+    conflicting = WGConfigSet(directory=str(tmp_path))
+    assert conflicting.get_interface_name(KEYS[0]) == 'wg0'
+    assert conflicting.conflicts == {KEYS[0]: set(['wg0', 'wg3'])}
+    assert conflicting.validate() == [{'interface': 'wg3', 'key': KEYS[0], 'attr': 'PublicKey', 'value': KEYS[0], 'message': 'peer also exists on interface wg0'}]
+    conflicting.del_peer(KEYS[0])
+    assert conflicting.get_interface_name(KEYS[0]) == 'wg3'
+    assert conflicting.validate() == []
+    conflicting.read_file('wg0') # the file still contains the peer
+    assert conflicting.get_interface_name(KEYS[0]) == 'wg3'
+    assert conflicting.conflicts == {KEYS[0]: set(['wg0', 'wg3'])}
+    wc.del_peer(KEYS[0])
+    wc.write_file()
+    conflicting.read_file('wg3')
+    assert conflicting.get_interface_name(KEYS[0]) == 'wg0'
+    assert conflicting.conflicts == dict()
+    assert sorted(conflicting.get_peers()) == sorted(KEYS)
+    configset = WGConfigSet([str(tmp_path / 'wg1.conf'), str(tmp_path / 'wg9.conf')])
+    assert list(configset.configs) == ['wg1', 'wg9']
+    assert configset.modified == set(['wg9'])
+
+def test_routing(configset):
+    from wgconfig import WGConfig
+    with pytest.raises(KeyError):
+        configset.add_peer('wg2', KEYS[0])
+    configset.add_peer('wg2', '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    assert configset.get_interface_name('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=') == 'wg2'
+    configset.add_attr(KEYS[3], 'AllowedIPs', '10.0.0.3/32')
+    configset.update_peers({KEYS[4]: {'AllowedIPs': '10.0.0.4/32'}, KEYS[14]: {'AllowedIPs': '10.0.1.4/32'}})
+    configset.disable_peer(KEYS[24])
+    assert not configset.get_peer_enabled(KEYS[24])
+    configset.move_peer(KEYS[3], 'wg1')
+    assert configset.get_interface_name(KEYS[3]) == 'wg1'
+    assert configset.get_peer(KEYS[3])['AllowedIPs'] == '10.0.0.3/32'
+    configset.del_peer(KEYS[5])
+    with pytest.raises(KeyError):
+        configset.get_peer(KEYS[5])
+    assert configset.write_files() == ['wg0', 'wg1', 'wg2']
+    assert configset.write_files() == []
+    wc = WGConfig(configset.configs['wg0'].filename)
+    wc.read_file()
+    assert wc.get_peer(KEYS[4])['AllowedIPs'] == '10.0.0.4/32'
+    assert KEYS[3] not in wc.get_peers()
+    configset.read_file('wg0')
+    assert configset.get_interface_name(KEYS[4]) == 'wg0'
+    assert configset.get_interface_name(KEYS[3]) == 'wg1'
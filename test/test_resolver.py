@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import io
+
+
+CONFIG = '''[Interface]
+PrivateKey = 6FYKQKEtGFAb5HSwyj5cQl3wgS1E9d6SqVjdVksOn2s=
+
+# alice
+[Peer]
+PublicKey = XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=
+Endpoint = alice.example.com:51820 # comment kept
+
+[Peer]
+PublicKey = eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=
+Endpoint = [fe80::3]:51820
+
+[Peer]
+PublicKey = ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=
+Endpoint = bob.example.com:51821
+
+[Peer]
+PublicKey = 801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=
+Endpoint = unknown.example.com:51820
+'''
+
+ADDRESSES = {'alice.example.com': '192.0.2.1', 'bob.example.com': '2001:db8::2'}
+
+
+class StubResolver():
+    """Resolves from a dictionary and counts the lookups"""
+
+    def __init__(self):
+        self.lookups = []
+
+    def __call__(self, host):
+        self.lookups.append(host)
+        return ADDRESSES[host]
+
+
+class Clock():
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def load():
+    import wgconfig
+    wc = wgconfig.WGConfig()
+    wc.read_from_fileobj(io.StringIO(CONFIG))
+    return wc
+
+def test_resolve_config():
+    from wgconfig.resolver import EndpointResolver
+    wc = load()
+    resolver = EndpointResolver(resolve=StubResolver())
+    resolved, failed = resolver.resolve_config(wc)
+    assert failed == ['unknown.example.com']
+    assert resolved.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')['Endpoint'] == '192.0.2.1:51820'
+    assert 'Endpoint = 192.0.2.1:51820 # comment kept' in resolved.lines
+    assert resolved.get_peer('eBvBVLo6wH0XkBfIjeLPf8ydBTfU/gMqJOH4nmVXcDE=')['Endpoint'] == '[fe80::3]:51820'
+    assert resolved.get_peer('ivBDO+pT2m4W5bl7ApNaC3BybEtYa1fvNpA4h+tHyy8=')['Endpoint'] == '[2001:db8::2]:51821'
+    assert 'Endpoint' not in resolved.get_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+    assert wc.get_peer('XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA=')['Endpoint'] == 'alice.example.com:51820' # original unchanged
+
+def test_cache():
+    from wgconfig.resolver import EndpointResolver
+    stub = StubResolver()
+    clock = Clock()
+    resolver = EndpointResolver(resolve=stub, ttl=300, negative_ttl=30, clock=clock)
+    hosts = ['alice.example.com', 'bob.example.com', 'unknown.example.com', 'alice.example.com']
+    assert resolver.resolve_hosts(hosts) == {'alice.example.com': '192.0.2.1', 'bob.example.com': '2001:db8::2', 'unknown.example.com': None}
+    assert sorted(stub.lookups) == ['alice.example.com', 'bob.example.com', 'unknown.example.com']
+    clock.now += 60 # failure expired
+    resolver.resolve_hosts(hosts)
+    assert len(stub.lookups) == 4
+    clock.now += 300 # everything expired
+    resolver.resolve_hosts(hosts)
+    assert len(stub.lookups) == 7
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import shutil
+import threading
+import pytest
+
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+TESTFILE1 = os.path.join(DIRNAME, 'wgtest1.conf')
+PEER1 = 'XWItB4SR1qwGbGn59oRE6TBlTYHQF0pDy1x63dlr5nA='
+NEWPEER = '801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM='
+
+
+@pytest.fixture
+def server(tmp_path):
+    from wgconfig.server import ConfigServer
+    shutil.copy(TESTFILE1, str(tmp_path / 'wg0.conf'))
+    server = ConfigServer(str(tmp_path / 'wgconfig.sock'), str(tmp_path))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def test_requests(server):
+    from wgconfig.server import ConfigClient
+    with ConfigClient(server.socket_path) as client:
+        assert client.request('list') == ['wg0']
+        assert PEER1 in client.request('get_peers', 'wg0')
+        assert client.request('get_peer', 'wg0', key=PEER1)['PersistentKeepalive'] == 25
+        with pytest.raises(KeyError):
+            client.request('get_peer', 'wg0', key=NEWPEER)
+        with pytest.raises(KeyError):
+            client.request('get_peers', 'wg1')
+        with pytest.raises(ValueError):
+            client.request('write_file', 'wg0')
+
+def test_batch_writes_once(server):
+    import wgconfig
+    from wgconfig.server import ConfigClient
+    filename = os.path.join(server.directory, 'wg0.conf')
+    with ConfigClient(server.socket_path) as client:
+        client.request('get_interface', 'wg0')
+        writes = []
+        original_write_file = server.configs['wg0'].write_file
+        server.configs['wg0'].write_file = lambda *args, **kwargs: writes.append(1) or original_write_file(*args, **kwargs)
+        responses = client.batch([
+            ('add_peer', 'wg0', {'key': NEWPEER}),
+            ('add_attr', 'wg0', {'key': NEWPEER, 'attr': 'AllowedIPs', 'value': '10.0.0.9/32'}),
+            ('disable_peer', 'wg0', {'key': 'unknown'}),
+            ('get_peer', 'wg0', {'key': NEWPEER}),
+        ])
+        assert responses[0] == {'result': None}
+        assert responses[2]['type'] == 'KeyError'
+        assert responses[3]['result']['AllowedIPs'] == '10.0.0.9/32'
+        assert len(writes) == 1
+    wc = wgconfig.WGConfig(filename)
+    wc.read_file()
+    assert wc.get_peer(NEWPEER)['AllowedIPs'] == '10.0.0.9/32'
+
+def test_reload_on_change(server):
+    import wgconfig
+    from wgconfig.server import ConfigClient
+    filename = os.path.join(server.directory, 'wg0.conf')
+    with ConfigClient(server.socket_path) as client:
+        assert NEWPEER not in client.request('get_peers', 'wg0')
+        wc = wgconfig.WGConfig(filename)
+        wc.read_file()
+        wc.add_peer(NEWPEER)
+        wc.write_file()
+        assert NEWPEER in client.request('get_peers', 'wg0')
+
+def test_batch_fails_on_concurrent_change(server):
+    import wgconfig
+    from wgconfig.server import ConfigClient
+    filename = os.path.join(server.directory, 'wg0.conf')
+    with ConfigClient(server.socket_path) as client:
+        client.request('get_interface', 'wg0')
+        served = server.configs['wg0']
+        original_add_peer = served.add_peer
+        def add_peer_with_concurrent_change(*args, **kwargs):
+            original_add_peer(*args, **kwargs)
+            wc = wgconfig.WGConfig(filename) # another process changes the file within the batch
+            wc.read_file()
+            wc.add_attr(None, 'MTU', 1420)
+            wc.write_file()
+        served.add_peer = add_peer_with_concurrent_change
+        responses = client.batch([
+            ('add_peer', 'wg0', {'key': NEWPEER}),
+            ('add_attr', 'wg0', {'key': NEWPEER, 'attr': 'AllowedIPs', 'value': '10.0.0.9/32'}),
+        ])
+        assert [response.get('type') for response in responses] == ['ConcurrentModificationError'] * 2
+        assert client.request('get_interface', 'wg0')['MTU'] == 1420
+        assert NEWPEER not in client.request('get_peers', 'wg0')
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import base64
+import pytest
+
+
+KEYS = [base64.b64encode(bytes([i]) * 32).decode() for i in range(200)]
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    from wgconfig.sharding import ShardedWGConfig
+    sharded = ShardedWGConfig([str(tmp_path / 'wg0.conf'), str(tmp_path / 'wg1.conf')])
+    for key in KEYS:
+        sharded.add_peer(key)
+    assert sharded.write_files() == ['wg0', 'wg1']
+    return sharded
+
+def test_routing(sharded):
+    for key in KEYS[:10]:
+        name = sharded.get_shard_name(key)
+        assert key in sharded.shards[name].get_peers()
+        sharded.add_attr(key, 'AllowedIPs', '10.0.0.1/32')
+        assert sharded.get_peer(key)['AllowedIPs'] == '10.0.0.1/32'
+    assert sorted(sharded.get_peers()) == sorted(KEYS)
+    assert 0 < len(sharded.shards['wg0'].get_peers()) < len(KEYS)
+    with pytest.raises(KeyError):
+        sharded.add_peer(KEYS[0])
+    sharded.del_peer(KEYS[0])
+    with pytest.raises(KeyError):
+        sharded.get_peer(KEYS[0])
+
+def test_write_changed_only(sharded):
+    key = KEYS[0]
+    name = sharded.get_shard_name(key)
+    sharded.disable_peer(key)
+    assert sharded.write_files() == [name]
+    sharded.enable_peer(key)
+    sharded.disable_peer(key) # back to the content of the file
+    assert sharded.write_files() == []
+    assert sharded.write_files() == []
+
+def test_rebalance(sharded, tmp_path):
+    from wgconfig.sharding import ShardedWGConfig
+    before = dict(sharded.index)
+    sharded.add_shard(str(tmp_path / 'wg2.conf'))
+    moved = [key for key in KEYS if sharded.index[key] != before[key]]
+    assert 0 < len(moved) < len(KEYS) / 2
+    assert all(sharded.index[key] == 'wg2' for key in moved) # only peers placed on the new shard move
+    assert sorted(sharded.shards['wg2'].get_peers()) == sorted(moved)
+    assert sorted(sharded.write_files()) == ['wg0', 'wg1', 'wg2']
+    # Reading the files results in the same placement
+    reread = ShardedWGConfig([str(tmp_path / name) for name in ['wg0.conf', 'wg1.conf', 'wg2.conf']])
+    assert reread.index == sharded.index
+    assert reread.rebalance() == 0
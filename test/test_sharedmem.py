@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+
+DIRNAME = os.path.dirname(os.path.realpath(__file__))
+TESTFILE1 = os.path.join(DIRNAME, 'wgtest1.conf')
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+
+@pytest.fixture
+def published():
+    import wgconfig
+    from wgconfig.sharedmem import SharedConfig
+    wc = wgconfig.WGConfig(TESTFILE1)
+    wc.read_file()
+    shared = SharedConfig.publish(wc)
+    yield wc, shared
+    shared.unlink()
+
+def test_lookups(published):
+    from wgconfig.sharedmem import SharedConfig
+    wc, shared = published
+    with SharedConfig.attach(shared.name) as view:
+        assert view.get_interface() == wc.get_interface()
+        assert view.get_peers() == wc.get_peers()
+        assert view.get_peers(include_disabled=True) == wc.get_peers(include_disabled=True)
+        assert view.get_peers(keys_only=False, include_disabled=True) == wc.get_peers(keys_only=False, include_disabled=True)
+        assert view.get_peers(include_disabled=True, offset=1, limit=1) == wc.get_peers(include_disabled=True, offset=1, limit=1)
+        assert view.get_peers(keys_only=False, fields=['Endpoint'], limit=1) == wc.get_peers(keys_only=False, fields=['Endpoint'], limit=1)
+        for key in wc.get_peers(include_disabled=True):
+            assert view.get_peer(key) == wc.get_peer(key)
+            assert view.get_peer_enabled(key) == wc.get_peer_enabled(key)
+        assert view.get_peer(key, include_details=True)['_disabled'] == True
+        with pytest.raises(KeyError):
+            view.get_peer('801mgm2JhjTOCxfihEknzFJGYxDvi+8oVYBrWe3hOWM=')
+
+def test_other_process(published):
+    wc, shared = published
+    script = 'import json, sys; from wgconfig.sharedmem import SharedConfig; view = SharedConfig.attach(sys.argv[1]); print(json.dumps(view.get_peers(keys_only=False))); view.close()'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.check_output([sys.executable, '-c', script, shared.name], env=env)
+    assert json.loads(output.decode('utf-8')) == wc.get_peers(keys_only=False)
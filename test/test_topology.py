@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import io
+import os
+import stat
+
+
+NODES = [
+    {'name': 'hub', 'PrivateKey': 'aHViLXByaXZhdGUta2V5LWZvci10ZXN0aW5nLW9ubHk=', 'PublicKey': 'aHViLXB1YmxpYy1rZXktZm9yLXRlc3Rpbmctb25seS0=',
+     'Address': '10.0.0.1/24', 'ListenPort': 51820, 'Endpoint': 'hub.example.com:51820'},
+    {'name': 'spoke1', 'PrivateKey': 'c3Bva2UxLXByaXZhdGUta2V5LWZvci10ZXN0aW5nLW8=', 'PublicKey': 'c3Bva2UxLXB1YmxpYy1rZXktZm9yLXRlc3RpbmctbzA=',
+     'Address': '10.0.0.2/24'},
+    {'name': 'spoke2', 'PrivateKey': 'c3Bva2UyLXByaXZhdGUta2V5LWZvci10ZXN0aW5nLW8=', 'PublicKey': 'c3Bva2UyLXB1YmxpYy1rZXktZm9yLXRlc3RpbmctbzA=',
+     'Address': '10.0.0.3/24, fd00::3/64', 'Endpoint': '192.0.2.3:51820'},
+]
+
+
+def parse(topology, name):
+    import wgconfig
+    fobj = io.StringIO()
+    topology.write_to_fileobj(name, fobj)
+    fobj.seek(0)
+    wc = wgconfig.WGConfig()
+    wc.read_from_fileobj(fobj)
+    return wc
+
+def test_hub_and_spoke():
+    from wgconfig.topology import Topology
+    topology = Topology(NODES, hub='hub', persistent_keepalive=25)
+    wc = parse(topology, 'hub')
+    assert wc.get_interface() == {'PrivateKey': NODES[0]['PrivateKey'], 'Address': '10.0.0.1/24', 'ListenPort': 51820}
+    assert wc.get_peers(keys_only=False) == {
+        NODES[1]['PublicKey']: {'PublicKey': NODES[1]['PublicKey'], 'AllowedIPs': '10.0.0.2/32'},
+        NODES[2]['PublicKey']: {'PublicKey': NODES[2]['PublicKey'], 'AllowedIPs': ['10.0.0.3/32', 'fd00::3/128'],
+                                'Endpoint': '192.0.2.3:51820', 'PersistentKeepalive': 25}}
+    wc = parse(topology, 'spoke1')
+    assert wc.get_peers(keys_only=False) == {
+        NODES[0]['PublicKey']: {'PublicKey': NODES[0]['PublicKey'], 'AllowedIPs': '10.0.0.0/24',
+                                'Endpoint': 'hub.example.com:51820', 'PersistentKeepalive': 25}}
+
+def test_full_mesh(tmp_path):
+    from wgconfig.topology import Topology
+    topology = Topology(NODES)
+    topology.write_files(str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == ['hub.conf', 'spoke1.conf', 'spoke2.conf']
+    assert stat.S_IMODE(os.stat(str(tmp_path / 'spoke1.conf')).st_mode) & 0o007 == 0
+    wc = parse(topology, 'spoke1')
+    assert sorted(wc.get_peers()) == sorted([NODES[0]['PublicKey'], NODES[2]['PublicKey']])
+    assert wc.get_peer(NODES[0]['PublicKey'])['AllowedIPs'] == '10.0.0.1/32'
+
+def test_generate_keys(tmp_path, monkeypatch):
+    from wgconfig.topology import Topology
+    fake_wg = tmp_path / 'wg'
+    fake_wg.write_text('#!/bin/sh\n'
+                       'case "$1" in\n'
+                       '  genkey) head -c 32 /dev/urandom | base64 ;;\n'
+                       '  pubkey) read k; echo "$k" | rev ;;\n'
+                       'esac\n')
+    fake_wg.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+    nodes = [{'name': 'a'}, {'name': 'b'}, {'name': 'c', 'PrivateKey': 'abc='}]
+    topology = Topology(nodes, hub='a')
+    topology.generate_keys()
+    assert topology.nodes['c']['PublicKey'] == '=cba'
+    for node in topology.nodes.values():
+        assert node['PublicKey'] == node['PrivateKey'][::-1]
+    assert len(set(node['PrivateKey'] for node in topology.nodes.values())) == 3
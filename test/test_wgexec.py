@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# The following imports are for Python2 support only
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fake_wg(tmp_path, monkeypatch):
+    """Places a fake "wg" on the PATH; "wg show" hangs until a marker file exists, counting its calls"""
+    from wgconfig import wgexec
+    fake_wg = tmp_path / 'wg'
+    fake_wg.write_text('#!/bin/sh\n'
+                       'echo x >> "{0}/calls"\n'
+                       'case "$1" in\n'
+                       '  genkey) echo "genkey-output" ;;\n'
+                       '  show) while [ ! -e "{0}/ready" ]; do sleep 0.05; done; echo "interface: wg0" ;;\n'
+                       '  fail) echo "failure" >&2; exit 1 ;;\n'
+                       '  hang) sleep 30 & wait ;;\n'
+                       'esac\n'.format(tmp_path))
+    fake_wg.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setattr(wgexec, 'latency_hook', wgexec.LatencyHistogram())
+    return tmp_path
+
+def get_calls(path):
+    return len((path / 'calls').read_text().split())
+
+def test_execute_timeout(fake_wg):
+    from wgconfig import wgexec
+    start = time.monotonic()
+    with pytest.raises(wgexec.CommandTimeoutError) as excinfo:
+        wgexec.execute_wgtools('wg show', timeout=0.2)
+    assert time.monotonic() - start < 2
+    assert excinfo.value.attempts == 1
+    assert get_calls(fake_wg) == 1
+    assert wgexec.latency_hook.outcomes['wg show'] == {'timeout': 1}
+    assert wgexec.execute_wgtools('wg genkey', timeout=5) == ('genkey-output\n', '', 0)
+    assert sum(count for bucket, count in wgexec.latency_hook.get_histogram('wg genkey')) == 1
+
+def test_execute_retry(fake_wg):
+    from wgconfig import wgexec
+    with pytest.raises(wgexec.CommandTimeoutError) as excinfo:
+        wgexec.execute_wgtools('wg show', timeout=0.1, retries=2, backoff=0.01)
+    assert excinfo.value.attempts == 3
+    assert get_calls(fake_wg) == 3
+    (fake_wg / 'ready').write_text('')
+    assert wgexec.execute_wgtools('wg show', timeout=5, retries=2)[0] == 'interface: wg0\n'
+    assert wgexec.latency_hook.outcomes['wg show'] == {'timeout': 3, 'ok': 1}
+
+def test_execute_deadline(fake_wg):
+    from wgconfig import wgexec
+    start = time.monotonic()
+    with pytest.raises(wgexec.CommandTimeoutError):
+        wgexec.execute_wgtools('wg show', deadline=start + 0.3, retries=100, backoff=0.05)
+    assert time.monotonic() - start < 2
+    with pytest.raises(wgexec.CommandTimeoutError) as excinfo:
+        wgexec.execute_wgtools('wg genkey', deadline=time.monotonic() - 1)
+    assert excinfo.value.attempts == 0
+    assert wgexec.execute_wgtools('wg fail', timeout=5) == ('', 'failure\n', 1)
+    assert wgexec.latency_hook.outcomes['wg fail'] == {'error': 1}
+
+def test_execute_kill_descendants(fake_wg, monkeypatch):
+    from wgconfig import wgexec
+    start = time.monotonic()
+    with pytest.raises(wgexec.CommandTimeoutError):
+        wgexec.execute_wgtools('wg hang', timeout=0.2) # a background child holds the pipes
+    assert time.monotonic() - start < 5
+    def killpg(pid, sig):
+        raise OSError('no process group')
+    monkeypatch.setattr(os, 'killpg', killpg)
+    monkeypatch.setattr(wgexec, 'REAP_TIMEOUT', 0.2)
+    start = time.monotonic()
+    with pytest.raises(wgexec.CommandTimeoutError):
+        wgexec.execute_wgtools('wg hang', timeout=0.2) # only the shell gets killed, the reap times out
+    assert time.monotonic() - start < 5
+    assert wgexec.latency_hook.outcomes['wg hang'] == {'timeout': 2}